@@ -1,4 +1,5 @@
 import asyncio
+import itertools
 import typing as t
 import weakref
 
@@ -9,7 +10,9 @@ from bot import ModmailBot
 from core import checks
 from core.models import PermissionLevel, getLogger
 from core.thread import Thread
-from .utils import get_or_fetch
+from .utils import async_tasks, db_buffer, get_or_fetch, load_timer, outbox, rest_scheduler, thread_classification
+from .utils.rest_scheduler import Priority
+from .utils.thread_classification import ThreadClassification
 
 PYDIS_NO_KICK_ROLE_IDS = (
     267627879762755584,  # Owners in PyDis
@@ -40,31 +43,79 @@ class BanAppeals(commands.Cog):
         self.logs_channel: t.Optional[discord.TextChannel] = None
 
         self.db = self.bot.plugin_db.get_partition(self)
+        self.tasks = async_tasks.get_supervisor(self.bot)
+        self.db_writes = db_buffer.WriteBehindBuffer(self.db, self.tasks, self.qualified_name)
+        self.rest = rest_scheduler.get_scheduler(self.bot)
+        self.classifier = thread_classification.get_classifier(self.bot)
+        self.outbox = outbox.NotificationOutbox(self._send_status, self.tasks, self.qualified_name)
 
         self.user_locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
         self.ignore_next_remove_event: set[int] = set()
+        # Numbers the tasks sending log messages, so each gets a unique name.
+        self._log_ids = itertools.count()
+        # Ids of the members of the appeals server, only kept when its member cache isn't available.
+        self.appeals_member_ids: set[int] = set()
+
+        # Template of the embed DMed to appellants, and the (footer, guild icon url) it was built with.
+        self._appeal_embed: t.Optional[discord.Embed] = None
+        self._appeal_embed_key: t.Optional[tuple[str, t.Optional[str]]] = None
 
     async def cog_load(self) -> None:
-        """Initialise the plugin's configuration."""
+        """
+        Initialise the plugin's configuration.
+
+        The sweep of the appeals server waits for the bot to be ready, so it doesn't hold up the load.
+        """
+        timer = load_timer.LoadTimer(self.qualified_name)
         self.pydis_guild = self.bot.guild
         self.appeals_guild = self.bot.get_guild(APPEAL_GUILD_ID)
 
-        db_categories = await self.db.find_one({"_id": "ban-appeal-categories"})
+        with timer.phase("db"):
+            db_categories = await self.db.find_one({"_id": "ban-appeal-categories"})
         db_categories = db_categories or {}
         self.appeal_categories = db_categories.get("categories", [])
         log.info("Loaded %s appeal categories", len(self.appeal_categories))
         self.logs_channel = discord.utils.get(self.appeals_guild.channels, name="logs")
 
         log.info("Plugin loaded, checking if there are people to kick.")
-        asyncio.create_task(self._sync_kicks())
+        # Only ever run a single sweep at a time.
+        self.tasks.set_limit(self.qualified_name, "sync-kicks", 1)
+        self.tasks.spawn(self.qualified_name, self._sync_kicks(), name="sync-kicks", group="sync-kicks")
+        self.db_writes.start()
+        self.classifier.set_resolver(self._classify_thread)
+        timer.log()
+
+    async def cog_unload(self) -> None:
+        """Cancel the background tasks of the plugin."""
+        self.classifier.remove_resolver(self._classify_thread)
+        await self.tasks.cancel_all(self.qualified_name)
+        await self.outbox.close()
+        await self.db_writes.close()
 
     async def _sync_kicks(self) -> None:
-        """Iter through all members in appeals guild, kick them if they meet criteria."""
+        """
+        Iter through all members in appeals guild, kick them if they meet criteria.
+
+        Without the member cache of the appeals server, members are streamed from the API page by page
+        instead, and the ids of the ones left in the server are kept to handle later events.
+        """
         await self.bot.wait_until_ready()
         log.info("Starting kick job for ban appeals server")
-        for member in self.appeals_guild.members:
-            await self._maybe_kick_user(member)
-        log.info("Kick job for ban appeals server completed")
+        timer = load_timer.LoadTimer(self.qualified_name)
+        if not self.bounded_members:
+            for member in self.appeals_guild.members:
+                await self._maybe_kick_user(member)
+        else:
+            log.info("Appeals server members aren't cached, fetching them from the API.")
+            async for member in self.appeals_guild.fetch_members(limit=None):
+                if not await self._maybe_kick_user(member):
+                    self.appeals_member_ids.add(member.id)
+        timer.log("Completed the kick job of")
+
+    @property
+    def bounded_members(self) -> bool:
+        """Whether the appeals server's member cache isn't available, so members are handled by id."""
+        return not self.appeals_guild.chunked
 
     async def _maybe_kick_user(self, member: discord.Member) -> bool:
         """
@@ -86,24 +137,22 @@ class BanAppeals(commands.Cog):
                 log.info("Not kicking %s (%d) as they have a bypass role", member, member.id)
                 return False
             try:
-                await member.kick(reason="Not banned in main server")
+                await self._kick(member, reason="Not banned in main server")
             except discord.Forbidden:
                 log.error("Failed to kick %s (%d) due to insufficient permissions.", member, member.id)
             else:
-                await self.logs_channel.send(
-                    f"Kicked {member} ({member.id}) on join as they're not banned in main server."
-                )
+                self._send_log(f"Kicked {member} ({member.id}) on join as they're not banned in main server.")
                 log.info("Kicked %s (%d).", member, member.id)
 
                 thread = await self.bot.threads.find(recipient=member)
                 if not thread:
-                    return False
+                    return True
 
-                embed = discord.Embed(
-                    description="The recipient joined the appeals server and has been automatically kicked.",
-                    color=self.bot.error_color
+                self.outbox.post(
+                    thread.channel,
+                    "The recipient joined the appeals server and has been automatically kicked.",
+                    self.bot.error_color,
                 )
-                await thread.channel.send(embed=embed)
                 self.ignore_next_remove_event.add(member.id)
 
                 return True
@@ -131,21 +180,17 @@ class BanAppeals(commands.Cog):
         if member.guild == self.pydis_guild:
             # Join event from PyDis
             # Kick them from appeals guild now they're back in PyDis
-            appeals_member = await get_or_fetch.get_or_fetch_member(self.appeals_guild, member.id)
-            if appeals_member:
-                await appeals_member.kick(reason="Rejoined PyDis")
-                await self.logs_channel.send(f"Kicked {member} ({member.id}) as they rejoined PyDis.")
+            if await self._kick_from_appeals(member, reason="Rejoined PyDis"):
+                self._send_log(f"Kicked {member} ({member.id}) as they rejoined PyDis.")
                 log.info("Kicked %s (%d) as they rejoined PyDis.", member, member.id)
 
                 thread = await self.bot.threads.find(recipient=member)
                 if not thread:
                     return
 
-                embed = discord.Embed(
-                    description="The recipient has been kicked from the appeals server.",
-                    color=self.bot.error_color
+                self.outbox.post(
+                    thread.channel, "The recipient has been kicked from the appeals server.", self.bot.error_color
                 )
-                await thread.channel.send(embed=embed)
                 self.ignore_next_remove_event.add(member.id)
         elif member.guild == self.appeals_guild:
             # Join event from the appeals server
@@ -154,6 +199,8 @@ class BanAppeals(commands.Cog):
             has_been_kicked = await self._maybe_kick_user(member)
             if has_been_kicked:
                 return
+            if self.bounded_members:
+                self.appeals_member_ids.add(member.id)
 
             thread = await self.bot.threads.find(recipient=member)
             if not thread:
@@ -163,44 +210,78 @@ class BanAppeals(commands.Cog):
             if thread.channel.category.id not in self.appeal_categories:
                 category = await self.get_useable_appeal_category()
                 description = f"Thread moved to `{category}` category since recipient has joined the appeals server."
-                await thread.channel.move(
+                await self.rest.call(
+                    Priority.MODERATION,
+                    f"channel.edit:{thread.channel.id}",
+                    thread.channel.move,
                     category=category,
                     end=True,
                     sync_permissions=True,
                     reason=f"{member} joined appeals server.",
                 )
 
-            embed = discord.Embed(
-                description=description,
-                color=self.bot.mod_color
-            )
-            await thread.channel.send(embed=embed)
+            self.outbox.post(thread.channel, description, self.bot.mod_color)
 
-    async def _handle_remove(self, member: discord.Member) -> None:
+    async def _handle_remove(self, user: t.Union[discord.User, discord.Member]) -> None:
         """
-        Notify if a member who is appealing leaves the appeals guild.
+        Notify if a user who is appealing leaves the appeals guild.
 
-        If the member's id is in the ignore set, then the current
+        If the user's id is in the ignore set, then the current
         event is skipped.
 
         An embed is sent in the thread once they leave.
         """
-        if not member.guild == self.appeals_guild:
-            return
-
+        self.appeals_member_ids.discard(user.id)
         try:
-            self.ignore_next_remove_event.remove(member.id)
+            self.ignore_next_remove_event.remove(user.id)
         except KeyError:
             pass
         else:
             return
 
-        thread = await self.bot.threads.find(recipient=member)
+        thread = await self.bot.threads.find(recipient=user)
         if not thread:
             return
 
-        embed = discord.Embed(description="The recipient has left the appeals server.", color=self.bot.error_color)
-        await thread.channel.send(embed=embed)
+        self.outbox.post(thread.channel, "The recipient has left the appeals server.", self.bot.error_color)
+
+    async def _kick(self, member: discord.abc.Snowflake, *, reason: str) -> None:
+        """Kick `member` from the appeals server through the REST scheduler."""
+        await self.rest.call(
+            Priority.MODERATION, f"guild.kick:{self.appeals_guild.id}", self.appeals_guild.kick, member, reason=reason
+        )
+
+    async def _kick_from_appeals(self, user: discord.abc.Snowflake, *, reason: str) -> bool:
+        """Kick `user` from the appeals server if they are in it, and return whether they were kicked."""
+        if not self.bounded_members:
+            appeals_member = await get_or_fetch.get_or_fetch_member(self.appeals_guild, user.id)
+            if not appeals_member:
+                return False
+            await self._kick(appeals_member, reason=reason)
+            return True
+
+        # Without the member cache, only kick users known to be in the server, by id.
+        if user.id not in self.appeals_member_ids:
+            return False
+        self.appeals_member_ids.discard(user.id)
+        try:
+            await self._kick(discord.Object(user.id), reason=reason)
+        except discord.NotFound:
+            return False
+        return True
+
+    def _send_log(self, content: str) -> None:
+        """Send `content` in the logs channel of the appeals server in the background, after more important calls."""
+        self.tasks.spawn(
+            self.qualified_name,
+            self.rest.call(Priority.LOG, f"channel.send:{self.logs_channel.id}", self.logs_channel.send, content),
+            name=f"log-{next(self._log_ids)}",
+            group="log",
+        )
+
+    async def _send_status(self, channel: discord.TextChannel, embed: discord.Embed) -> None:
+        """Send a status `embed` in the thread `channel`, prefer posting to the outbox to combine updates."""
+        await self.rest.call(Priority.STATUS, f"channel.send:{channel.id}", channel.send, embed=embed)
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member) -> None:
@@ -218,16 +299,36 @@ class BanAppeals(commands.Cog):
     @commands.Cog.listener()
     async def on_member_remove(self, member: discord.Member) -> None:
         """
-        Acquire a lock and handle member removals.
+        Acquire a lock and handle member removals from the appeals server.
 
         A lock is acquired so that subsequent join and leave events
         happen only after the current member remove event is fully
         handled.
+
+        Without the member cache, removals are handled from the raw event instead.
         """
+        if member.guild != self.appeals_guild or self.bounded_members:
+            return
+
         user_lock = self.user_locks.setdefault(member.id, asyncio.Lock())
         async with user_lock:
             await self._handle_remove(member)
 
+    @commands.Cog.listener()
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent) -> None:
+        """
+        Acquire a lock and handle member removals from the appeals server, when its member cache isn't available.
+
+        discord.py only dispatches `member_remove` for cached members, which members fetched
+        by the sweep aren't, while the raw event is dispatched for every member.
+        """
+        if payload.guild_id != self.appeals_guild.id or not self.bounded_members:
+            return
+
+        user_lock = self.user_locks.setdefault(payload.user.id, asyncio.Lock())
+        async with user_lock:
+            await self._handle_remove(payload.user)
+
     @checks.has_permissions(PermissionLevel.SUPPORTER)
     @commands.group(invoke_without_command=True, aliases=("appeal_category",))
     async def appeal_category_management(self, ctx: commands.Context) -> None:
@@ -250,12 +351,12 @@ class BanAppeals(commands.Cog):
             await ctx.send(f":x: {appeal_category} already in the appeal category list.")
             return
 
-        self.appeal_categories.append(appeal_category.id)
-        await self.db.find_one_and_update(
-            {"_id": "ban-appeal-categories"},
+        await self.db_writes.update(
+            "ban-appeal-categories",
             {"$addToSet": {"categories": appeal_category.id}},
-            upsert=True,
+            durable=True,
         )
+        self.appeal_categories.append(appeal_category.id)
 
         await ctx.send(f":+1: Added {appeal_category} to the available appeal categories.")
 
@@ -267,11 +368,12 @@ class BanAppeals(commands.Cog):
             await ctx.send(f":x: {category_to_remove} isn't in the appeal categories list.")
             return
 
-        self.appeal_categories.remove(category_to_remove.id)
-        await self.db.find_one_and_update(
-            {"_id": "ping-delay-config"},
-            {"$pull": {"ignored_categories": category_to_remove.id}},
+        await self.db_writes.update(
+            "ban-appeal-categories",
+            {"$pull": {"categories": category_to_remove.id}},
+            durable=True,
         )
+        self.appeal_categories.remove(category_to_remove.id)
         await ctx.send(f":+1: Removed {category_to_remove} from the appeal categories list.")
 
     async def get_useable_appeal_category(self) -> t.Optional[discord.CategoryChannel]:
@@ -282,33 +384,91 @@ class BanAppeals(commands.Cog):
                 return category
         return None
 
-    @commands.Cog.listener()
-    async def on_thread_ready(self, thread: Thread, *args) -> None:
-        """If the new thread is for an appeal, move it to the appeals category."""
-        if await self._is_banned_pydis(thread.recipient):
-            category = await self.get_useable_appeal_category()
-            if category:
-                await thread.channel.edit(category=category, sync_permissions=True)
-            else:
-                await thread.channel.send("ERROR! Could not move thread to an appeal category as they're all full!")
+    async def _classify_thread(self, thread: Thread) -> ThreadClassification:
+        """
+        Classify a new thread for every plugin, with a single ban lookup.
 
-            embed = discord.Embed(
-                colour=self.bot.mod_color,
-                description=BAN_APPEAL_MESSAGE,
-                timestamp=thread.channel.created_at,
+        Threads of users banned in PyDis are appeals, and end up in the first appeal category with room left.
+        """
+        if not await self._is_banned_pydis(thread.recipient):
+            return ThreadClassification.regular(thread)
+
+        category = await self.get_useable_appeal_category()
+        return ThreadClassification(
+            channel_id=thread.channel.id,
+            category_id=category.id if category else thread.channel.category_id,
+            is_appeal=True,
+            appeal_category=category,
+        )
+
+    def _get_appeal_embed(self, thread: Thread) -> discord.Embed:
+        """Return the embed DMed to the recipient of the appeal `thread`, from a template rebuilt on config changes."""
+        if self.bot.config.get("recipient_thread_close"):
+            footer = self.bot.config["thread_self_closable_creation_footer"]
+        else:
+            footer = self.bot.config["thread_creation_footer"]
+        icon_url = self.bot.guild.icon.url if self.bot.guild.icon else None
+
+        if self._appeal_embed_key != (footer, icon_url):
+            embed = discord.Embed(title="Ban appeal", description=BAN_APPEAL_MESSAGE)
+            embed.set_footer(text=footer, icon_url=icon_url)
+            self._appeal_embed = embed
+            self._appeal_embed_key = (footer, icon_url)
+
+        # The colour is set on each copy, as it can be changed in the config without touching the template.
+        embed = self._appeal_embed.copy()
+        embed.colour = self.bot.mod_color
+        embed.timestamp = thread.channel.created_at
+        return embed
+
+    async def _move_appeal(self, thread: Thread, category: t.Optional[discord.CategoryChannel]) -> None:
+        """Move the appeal `thread` to `category`, or notify in the thread that all appeal categories are full."""
+        if category:
+            await self.rest.call(
+                Priority.MODERATION,
+                f"channel.edit:{thread.channel.id}",
+                thread.channel.edit,
+                category=category,
+                sync_permissions=True,
+            )
+        else:
+            await self.rest.call(
+                Priority.STATUS,
+                f"channel.send:{thread.channel.id}",
+                thread.channel.send,
+                "ERROR! Could not move thread to an appeal category as they're all full!",
             )
 
-            recipient_thread_close = self.bot.config.get("recipient_thread_close")
+    async def _dm_appeal(self, thread: Thread) -> None:
+        """DM the recipient of the appeal `thread` about how appeals are handled."""
+        embed = self._get_appeal_embed(thread)
+        await self.rest.call(Priority.STATUS, f"dm.send:{thread.recipient.id}", thread.recipient.send, embed=embed)
 
-            if recipient_thread_close:
-                footer = self.bot.config["thread_self_closable_creation_footer"]
-            else:
-                footer = self.bot.config["thread_creation_footer"]
+    @commands.Cog.listener()
+    async def on_thread_ready(self, thread: Thread, *args) -> None:
+        """
+        If the new thread is for an appeal, move it to the appeals category.
 
-            embed.set_footer(text=footer, icon_url=self.bot.guild.icon.url)
-            embed.title = "Ban appeal"
+        Moving the thread and DMing the recipient don't depend on each other, so they're done
+        concurrently, and one failing doesn't stop the other.
+        """
+        classification = await self.classifier.classify(thread)
+        if not classification.is_appeal:
+            return
 
-            await thread.recipient.send(embed=embed)
+        results = await asyncio.gather(
+            self._move_appeal(thread, classification.appeal_category),
+            self._dm_appeal(thread),
+            return_exceptions=True,
+        )
+        for step, result in zip(("move", "DM the recipient of"), results):
+            if isinstance(result, Exception):
+                log.error("Failed to %s appeal thread %s.", step, thread.channel, exc_info=result)
+
+    @commands.Cog.listener()
+    async def on_thread_close(self, thread: Thread, *args) -> None:
+        """Forget the classification of the closed thread."""
+        self.classifier.forget(thread.channel.id)
 
 
 async def setup(bot: ModmailBot) -> None:
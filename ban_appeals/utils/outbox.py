@@ -0,0 +1,138 @@
+import asyncio
+import typing as t
+from collections import deque
+from dataclasses import dataclass
+
+import discord
+
+from core.models import getLogger
+
+if t.TYPE_CHECKING:
+    from .async_tasks import TaskSupervisor
+
+log = getLogger(__name__)
+
+# Seconds status updates are collected for before being sent as a single embed.
+COALESCE_WINDOW = 2.0
+# Number of updates kept per thread, older ones are dropped past this.
+MAX_PENDING_UPDATES = 10
+# Number of times sending an embed is attempted when Discord errors out.
+MAX_ATTEMPTS = 3
+# Seconds waited before the first retry, doubled for each following retry.
+RETRY_DELAY = 1.0
+
+# Errors which are worth retrying, as they're likely to go away.
+TRANSIENT_ERRORS = (discord.DiscordServerError, asyncio.TimeoutError)
+
+Colour = t.Union[int, discord.Colour]
+
+
+@dataclass
+class StatusUpdate:
+    """A status line to show in a thread."""
+
+    description: str
+    colour: Colour
+
+
+@dataclass
+class _ThreadOutbox:
+    """Status updates waiting to be sent in a thread."""
+
+    channel: discord.TextChannel
+    updates: deque[StatusUpdate]
+    dropped: int = 0
+
+
+class NotificationOutbox:
+    """
+    Collect the status updates of each thread, and send them as one embed.
+
+    Updates posted to a thread within `window` seconds of each other are combined, so a
+    user flapping between servers doesn't cause a message per event. Sending is retried on
+    transient errors, and only the latest `max_pending` updates of a thread are kept.
+    """
+
+    def __init__(
+        self,
+        send: t.Callable[[discord.TextChannel, discord.Embed], t.Awaitable[None]],
+        supervisor: "TaskSupervisor",
+        owner: str,
+        *,
+        window: float = COALESCE_WINDOW,
+        max_pending: int = MAX_PENDING_UPDATES,
+    ):
+        self.send = send
+        self.supervisor = supervisor
+        self.owner = owner
+        self.window = window
+        self.max_pending = max_pending
+        self._outboxes: dict[int, _ThreadOutbox] = {}
+
+    def post(self, channel: discord.TextChannel, description: str, colour: Colour) -> None:
+        """Queue a status update for the thread `channel`, to be sent after the coalescing window."""
+        outbox = self._outboxes.get(channel.id)
+        if outbox is None:
+            outbox = self._outboxes[channel.id] = _ThreadOutbox(channel, deque(maxlen=self.max_pending))
+
+        # Also respawn the delivery task if it died without clearing the outbox.
+        name = f"outbox-{channel.id}"
+        if not (task := self.supervisor.get_task(self.owner, name)) or task.done():
+            self.supervisor.spawn(self.owner, self._deliver(channel.id), name=name, group="outbox")
+
+        if len(outbox.updates) == self.max_pending:
+            outbox.dropped += 1
+        outbox.updates.append(StatusUpdate(description, colour))
+
+    def _build_embed(self, updates: list[StatusUpdate], dropped: int) -> discord.Embed:
+        """Combine `updates` into a single embed, with the colour of the latest one."""
+        lines = [update.description for update in updates]
+        if dropped:
+            lines.insert(0, f"*{dropped} earlier updates not shown.*")
+        return discord.Embed(description="\n".join(lines), color=updates[-1].colour)
+
+    async def _send(self, channel: discord.TextChannel, embed: discord.Embed) -> None:
+        """Send `embed` in `channel`, retrying on transient errors."""
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                await self.send(channel, embed)
+                return
+            except TRANSIENT_ERRORS as error:
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                delay = RETRY_DELAY * 2 ** attempt
+                log.warning("Failed to send a status update in %s (%r), retrying in %.1fs.", channel, error, delay)
+                await asyncio.sleep(delay)
+
+    async def _deliver(self, channel_id: int) -> None:
+        """Send the updates of the thread in `channel_id` once per window, until there are none left."""
+        outbox = self._outboxes[channel_id]
+        while outbox.updates:
+            await asyncio.sleep(self.window)
+            updates, dropped = list(outbox.updates), outbox.dropped
+            outbox.updates.clear()
+            outbox.dropped = 0
+            try:
+                await self._send(outbox.channel, self._build_embed(updates, dropped))
+            except asyncio.CancelledError:
+                # Put the updates back so they're sent when the outbox is closed.
+                merged = updates + list(outbox.updates)
+                outbox.updates.clear()
+                outbox.updates.extend(merged)
+                outbox.dropped += dropped + max(0, len(merged) - self.max_pending)
+                raise
+            except discord.HTTPException:
+                log.exception("Failed to send %d status updates in %s, dropping them.", len(updates), outbox.channel)
+        del self._outboxes[channel_id]
+
+    async def close(self) -> None:
+        """Send every pending update straight away, once the delivery tasks have been cancelled."""
+        outboxes = list(self._outboxes.values())
+        self._outboxes.clear()
+        for outbox in outboxes:
+            if not outbox.updates:
+                continue
+            try:
+                await self._send(outbox.channel, self._build_embed(list(outbox.updates), outbox.dropped))
+            except discord.HTTPException:
+                log.exception("Failed to send pending status updates in %s.", outbox.channel)
@@ -0,0 +1,119 @@
+"""
+Classify new threads once for every plugin, with a classifier shared by the plugins through the bot.
+
+Plugins each have a copy of this module, and the classifier is kept on the bot under an attribute
+including `CLASSIFIER_VERSION`, so only plugins of the same version share one. Bump the version on
+any change to `ThreadClassifier` or `ThreadClassification`.
+
+Reloading a plugin, e.g. with `?plugin update`, keeps the classifier of the same version, running
+the code it was created with until the bot restarts. Classifiers of older versions are dropped from
+the bot once none of their classifications is still being computed.
+"""
+import asyncio
+import functools
+import typing as t
+from dataclasses import dataclass
+
+import discord
+
+if t.TYPE_CHECKING:
+    from bot import ModmailBot
+    from core.thread import Thread
+
+# Version of `ThreadClassifier`, part of the attribute of the bot holding the classifier shared by every plugin.
+CLASSIFIER_VERSION = 1
+CLASSIFIER_ATTRIBUTE = f"_pydis_thread_classifier_v{CLASSIFIER_VERSION}"
+
+# Number of classifications kept, in case threads get deleted without a close event.
+MAX_CLASSIFICATIONS = 5000
+
+
+@dataclass(frozen=True)
+class ThreadClassification:
+    """What the plugins need to know about a new thread, computed once for all of them."""
+
+    channel_id: int
+    # Id of the category the thread is going to end up in.
+    category_id: t.Optional[int]
+    is_appeal: bool = False
+    # Category an appeal thread gets moved to, None if the thread isn't an appeal or all appeal categories are full.
+    appeal_category: t.Optional[discord.CategoryChannel] = None
+
+    @classmethod
+    def regular(cls, thread: "Thread") -> "ThreadClassification":
+        """Return the classification of a thread which stays where it was created."""
+        return cls(channel_id=thread.channel.id, category_id=thread.channel.category_id)
+
+
+Resolver = t.Callable[["Thread"], t.Awaitable[ThreadClassification]]
+
+
+class ThreadClassifier:
+    """
+    Classify each thread once, and cache the result until the thread is closed.
+
+    A plugin that knows more about threads can register a resolver to compute the
+    classification, otherwise threads are classified as regular threads.
+
+    A single classifier is shared by every plugin through `get_classifier`.
+    """
+
+    def __init__(self):
+        self.resolver: t.Optional[Resolver] = None
+        self._classifications: dict[int, asyncio.Future] = {}
+
+    def set_resolver(self, resolver: Resolver) -> None:
+        """Compute the classification of new threads with `resolver`."""
+        self.resolver = resolver
+
+    def remove_resolver(self, resolver: Resolver) -> None:
+        """Stop using `resolver`, if it's still the registered one."""
+        if self.resolver == resolver:
+            self.resolver = None
+
+    @property
+    def idle(self) -> bool:
+        """Whether no classification is being computed."""
+        return all(future.done() for future in self._classifications.values())
+
+    async def classify(self, thread: "Thread") -> ThreadClassification:
+        """Return the classification of `thread`, computing it if no other plugin did yet."""
+        channel_id = thread.channel.id
+        if channel_id not in self._classifications:
+            if len(self._classifications) >= MAX_CLASSIFICATIONS:
+                del self._classifications[next(iter(self._classifications))]
+            future = asyncio.ensure_future(self._classify(thread))
+            future.add_done_callback(functools.partial(self._forget_failed, channel_id))
+            self._classifications[channel_id] = future
+        # Shield the shared computation from the cancellation of a single caller.
+        return await asyncio.shield(self._classifications[channel_id])
+
+    async def _classify(self, thread: "Thread") -> ThreadClassification:
+        if self.resolver is None:
+            return ThreadClassification.regular(thread)
+        return await self.resolver(thread)
+
+    def _forget_failed(self, channel_id: int, future: asyncio.Future) -> None:
+        """Drop a classification that failed, so it's computed again next time."""
+        if not future.cancelled() and future.exception() is None:
+            return
+        if self._classifications.get(channel_id) is future:
+            del self._classifications[channel_id]
+
+    def forget(self, channel_id: int) -> None:
+        """Forget the classification of the thread in `channel_id`, once it's closed."""
+        self._classifications.pop(channel_id, None)
+
+
+def get_classifier(bot: "ModmailBot") -> ThreadClassifier:
+    """Return the thread classifier shared by all plugins, creating it if needed, and drop idle older ones."""
+    for version in range(1, CLASSIFIER_VERSION):
+        attribute = f"_pydis_thread_classifier_v{version}"
+        if getattr(getattr(bot, attribute, None), "idle", False):
+            delattr(bot, attribute)
+
+    classifier = getattr(bot, CLASSIFIER_ATTRIBUTE, None)
+    if classifier is None:
+        classifier = ThreadClassifier()
+        setattr(bot, CLASSIFIER_ATTRIBUTE, classifier)
+    return classifier
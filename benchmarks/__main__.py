@@ -0,0 +1,70 @@
+"""
+Run the plugin benchmarks.
+
+Run `python -m benchmarks --help` from the root of the repository, with a modmail
+checkout on the python path, for the available options.
+"""
+import argparse
+import asyncio
+import inspect
+import logging
+
+from benchmarks import results
+from benchmarks.scenarios import SCENARIOS
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the plugins against in-memory Discord and Mongo fakes.")
+    parser.add_argument(
+        "scenarios", nargs="*", metavar="scenario", help=f"Scenarios to run, all by default: {', '.join(SCENARIOS)}."
+    )
+    parser.add_argument("--members", type=int, help="Members in the appeals guild for sync_kicks.")
+    parser.add_argument("--tasks", type=int, help="Pending ping tasks for ping_backlog.")
+    parser.add_argument("--threads", type=int, help="Concurrent threads for reply_cooldown.")
+    parser.add_argument("--rest-latency", type=float, help="Seconds taken by each fake REST call.")
+    parser.add_argument("--db-latency", type=float, help="Seconds taken by each fake db operation.")
+    parser.add_argument(
+        "--route-limits", action="store_true", default=None, help="Apply Discord's route limits to the REST calls."
+    )
+    parser.add_argument("--seed", type=int, help="Seed of the generated data.")
+    parser.add_argument("--json", metavar="PATH", help="Also write the results to a JSON file.")
+    args = parser.parse_args()
+    if unknown := set(args.scenarios) - set(SCENARIOS):
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}.")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    return args
+
+
+async def _run(args: argparse.Namespace) -> list[results.Result]:
+    options = {
+        "members": args.members,
+        "tasks": args.tasks,
+        "threads": args.threads,
+        "rest_latency": args.rest_latency,
+        "db_latency": args.db_latency,
+        "route_limits": args.route_limits,
+        "seed": args.seed,
+    }
+    scenario_results = []
+    for name in args.scenarios:
+        scenario = SCENARIOS[name]
+        parameters = inspect.signature(scenario).parameters
+        kwargs = {key: value for key, value in options.items() if value is not None and key in parameters}
+        result = await scenario(**kwargs)
+        print(result.format())
+        scenario_results.append(result)
+    return scenario_results
+
+
+def main() -> None:
+    """Run the benchmarks selected on the command line."""
+    args = _parse_args()
+    # The plugins log every kick and ping, which would drown the results.
+    logging.disable(logging.INFO)
+    scenario_results = asyncio.run(_run(args))
+    if args.json:
+        results.dump(scenario_results, args.json)
+
+
+if __name__ == "__main__":
+    main()
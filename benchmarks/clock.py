@@ -0,0 +1,73 @@
+"""
+An event loop running on a virtual clock.
+
+Whenever the loop would block waiting for the next scheduled callback, it moves its clock
+forward instead, so hours of `asyncio.sleep` run in as long as the code in between takes.
+"""
+import asyncio
+import contextlib
+import selectors
+import types
+import typing as t
+from datetime import datetime, timedelta
+
+
+class _VirtualSelector:
+    """Wrap a selector to advance the loop's clock instead of blocking."""
+
+    def __init__(self, loop: "VirtualClockLoop", selector: selectors.BaseSelector):
+        self._loop = loop
+        self._selector = selector
+
+    def select(self, timeout: t.Optional[float] = None) -> list:
+        if timeout is None:
+            # Nothing is scheduled, only real I/O can wake the loop up.
+            return self._selector.select(timeout)
+        events = self._selector.select(0)
+        if not events and timeout > 0:
+            self._loop.advance(timeout)
+        return events
+
+    def __getattr__(self, name: str) -> object:
+        return getattr(self._selector, name)
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """A selector event loop whose `time()` only moves forward when nothing is ready to run."""
+
+    def __init__(self, start: float = 0.0):
+        super().__init__()
+        self._virtual_time = start
+        self._selector = _VirtualSelector(self, self._selector)
+
+    def time(self) -> float:
+        """Return the virtual time of the loop."""
+        return self._virtual_time
+
+    def advance(self, seconds: float) -> None:
+        """Move the clock `seconds` forward."""
+        self._virtual_time += seconds
+
+
+def virtual_datetime(loop: asyncio.AbstractEventLoop, epoch: datetime) -> type[datetime]:
+    """Return a `datetime` subclass whose `utcnow` follows the clock of `loop`, starting at `epoch`."""
+    class VirtualDatetime(datetime):
+        @classmethod
+        def utcnow(cls) -> datetime:
+            now = epoch + timedelta(seconds=loop.time())
+            return cls.combine(now.date(), now.time())
+
+    return VirtualDatetime
+
+
+@contextlib.contextmanager
+def patch_datetime(modules: t.Iterable[types.ModuleType], replacement: type[datetime]) -> t.Iterator[None]:
+    """Replace the `datetime` class imported by each of `modules` with `replacement`."""
+    modules = [module for module in modules if getattr(module, "datetime", None) is datetime]
+    for module in modules:
+        module.datetime = replacement
+    try:
+        yield
+    finally:
+        for module in modules:
+            module.datetime = datetime
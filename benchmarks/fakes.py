@@ -0,0 +1,523 @@
+"""
+In-memory stand-ins for the Discord objects, the REST API and the Mongo database used by the plugins.
+
+The fakes only implement what the plugins use. Every REST call and db operation is counted,
+and can be given a latency to simulate a slow API or database.
+"""
+import asyncio
+import copy
+import heapq
+import itertools
+import typing as t
+from collections import Counter
+from datetime import datetime
+from types import SimpleNamespace
+
+import discord
+from pymongo.errors import DuplicateKeyError
+
+# Number of members returned by each request of `FakeGuild.fetch_members`, as in Discord's API.
+MEMBERS_PAGE_SIZE = 1000
+
+_ids = itertools.count(10**17)
+
+
+def next_id() -> int:
+    """Return a new unique snowflake-like id."""
+    return next(_ids)
+
+
+class _FakeResponse:
+    """The bits of an aiohttp response needed to build a `discord.HTTPException`."""
+
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+
+def not_found(message: str) -> discord.NotFound:
+    """Return the exception discord.py raises for a 404 response."""
+    return discord.NotFound(_FakeResponse(404, "Not Found"), message)
+
+
+class FakeRest:
+    """A fake Discord REST API counting the calls made to each route."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+
+    async def request(self, route: str) -> None:
+        """Record a call to `route` and wait for the configured latency."""
+        self.calls[route] += 1
+        await asyncio.sleep(self.latency)
+
+
+class FakeRole:
+    """A guild role."""
+
+    def __init__(self, role_id: t.Optional[int] = None, name: str = "role"):
+        self.id = role_id or next_id()
+        self.name = name
+
+
+class FakeUser:
+    """A Discord user that can be sent DMs."""
+
+    def __init__(self, rest: FakeRest, user_id: t.Optional[int] = None, *, bot: bool = False):
+        self.id = user_id or next_id()
+        self.name = f"user{self.id}"
+        self.bot = bot
+        self._rest = rest
+        self.dms: list[dict] = []
+
+    def __str__(self) -> str:
+        return self.name
+
+    async def send(self, content: t.Optional[str] = None, **kwargs) -> None:
+        """Send a DM to the user."""
+        await self._rest.request("dm.send")
+        self.dms.append({"content": content, **kwargs})
+
+
+class FakeMember(FakeUser):
+    """A member of a `FakeGuild`."""
+
+    def __init__(
+        self,
+        guild: "FakeGuild",
+        user_id: t.Optional[int] = None,
+        *,
+        roles: t.Iterable[FakeRole] = (),
+        bot: bool = False,
+    ):
+        super().__init__(guild.rest, user_id, bot=bot)
+        self.guild = guild
+        self.roles = list(roles)
+
+    async def kick(self, *, reason: t.Optional[str] = None) -> None:
+        """Kick the member from their guild."""
+        await self.guild.kick(self, reason=reason)
+
+
+class FakeCategory:
+    """A category channel."""
+
+    def __init__(self, guild: "FakeGuild", name: str = "category", category_id: t.Optional[int] = None):
+        self.id = category_id or next_id()
+        self.name = name
+        self.guild = guild
+        self.channels: list[FakeTextChannel] = []
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeTextChannel:
+    """A text channel recording the messages sent in it."""
+
+    def __init__(self, guild: "FakeGuild", name: str = "channel", category: t.Optional[FakeCategory] = None):
+        self.id = next_id()
+        self.name = name
+        self.guild = guild
+        self.category: t.Optional[FakeCategory] = None
+        self.created_at = datetime.utcnow()
+        self.messages: list[dict] = []
+        self.sent_at: list[datetime] = []
+        self._set_category(category)
+
+    def __str__(self) -> str:
+        return self.name
+
+    @property
+    def category_id(self) -> t.Optional[int]:
+        """Id of the channel's category."""
+        return self.category.id if self.category else None
+
+    def _set_category(self, category: t.Optional[FakeCategory]) -> None:
+        if self.category:
+            self.category.channels.remove(self)
+        self.category = category
+        if category:
+            category.channels.append(self)
+
+    async def send(self, content: t.Optional[str] = None, **kwargs) -> None:
+        """Send a message in the channel."""
+        await self.guild.rest.request("channel.send")
+        if self.guild.deleted_channel(self.id):
+            raise not_found("Unknown Channel")
+        self.messages.append({"content": content, **kwargs})
+        self.sent_at.append(datetime.utcnow())
+
+    async def edit(self, *, category: t.Optional[FakeCategory] = None, name: t.Optional[str] = None, **_) -> None:
+        """Edit the channel, only the category and the name are kept track of."""
+        await self.guild.rest.request("channel.edit")
+        if category is not None:
+            self._set_category(category)
+        if name is not None:
+            self.name = name
+
+    async def move(self, *, category: t.Optional[FakeCategory] = None, **_) -> None:
+        """Move the channel to another category."""
+        await self.edit(category=category)
+
+    async def set_permissions(self, target: object, **_) -> None:
+        """Change the permission overwrites of the channel."""
+        await self.guild.rest.request("channel.permissions")
+
+
+class FakeGuild:
+    """
+    A guild with its members, bans and channels.
+
+    When `chunked` is False the bot has no member cache of the guild, and like discord.py only
+    caches the members who joined while it was running. Other members are only available through
+    `fetch_member` and `fetch_members`.
+    """
+
+    def __init__(self, rest: FakeRest, guild_id: t.Optional[int] = None, name: str = "guild"):
+        self.id = guild_id or next_id()
+        self.name = name
+        self.rest = rest
+        self.icon = SimpleNamespace(url="https://cdn.discordapp.com/icons/0/0.png")
+        self.chunked = True
+        self.bans: set[int] = set()
+        self.channels: list[t.Union[FakeTextChannel, FakeCategory]] = []
+        self.roles: dict[int, FakeRole] = {}
+        self._members: dict[int, FakeMember] = {}
+        # Ids of the members cached without the guild being chunked.
+        self._cached_member_ids: set[int] = set()
+        self._channels_by_id: dict[int, t.Union[FakeTextChannel, FakeCategory]] = {}
+        self._deleted_channels: set[int] = set()
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, FakeGuild) and other.id == self.id
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+    @property
+    def members(self) -> list[FakeMember]:
+        """The cached members of the guild."""
+        if self.chunked:
+            return list(self._members.values())
+        return [self._members[member_id] for member_id in self._cached_member_ids]
+
+    @property
+    def member_count(self) -> int:
+        """The number of members in the guild, cached or not."""
+        return len(self._members)
+
+    def add_member(self, member: FakeMember, *, joined: bool = False) -> FakeMember:
+        """Add `member` to the guild, caching them if they `joined` while the bot was running."""
+        self._members[member.id] = member
+        if joined:
+            self._cached_member_ids.add(member.id)
+        return member
+
+    def remove_member(self, member_id: int) -> None:
+        """Remove the member with the id `member_id` from the guild, if they are in it."""
+        self._members.pop(member_id, None)
+        self._cached_member_ids.discard(member_id)
+
+    def add_channel(self, channel: t.Union[FakeTextChannel, FakeCategory]) -> t.Union[FakeTextChannel, FakeCategory]:
+        """Add `channel` to the guild."""
+        self.channels.append(channel)
+        self._channels_by_id[channel.id] = channel
+        return channel
+
+    def delete_channel(self, channel_id: int) -> None:
+        """Mark the channel with the id `channel_id` as deleted."""
+        self._deleted_channels.add(channel_id)
+
+    def deleted_channel(self, channel_id: int) -> bool:
+        """Whether the channel with the id `channel_id` was deleted."""
+        return channel_id in self._deleted_channels
+
+    def get_member(self, member_id: int) -> t.Optional[FakeMember]:
+        """Get a member from the cache."""
+        if self.chunked or member_id in self._cached_member_ids:
+            return self._members.get(member_id)
+        return None
+
+    async def fetch_member(self, member_id: int) -> FakeMember:
+        """Fetch a member from the API."""
+        await self.rest.request("guild.fetch_member")
+        if member_id not in self._members:
+            raise not_found("Unknown Member")
+        return self._members[member_id]
+
+    async def fetch_members(self, *, limit: t.Optional[int] = 1000) -> t.AsyncIterator[FakeMember]:
+        """Fetch up to `limit` members from the API, by pages of `MEMBERS_PAGE_SIZE` members in id order."""
+        after = 0
+        fetched = 0
+        while limit is None or fetched < limit:
+            await self.rest.request("guild.fetch_members")
+            page = heapq.nsmallest(MEMBERS_PAGE_SIZE, (member_id for member_id in self._members if member_id > after))
+            for member_id in page:
+                if member_id in self._members and (limit is None or fetched < limit):
+                    fetched += 1
+                    yield self._members[member_id]
+            if len(page) < MEMBERS_PAGE_SIZE:
+                return
+            after = page[-1]
+
+    async def fetch_ban(self, user: FakeUser) -> object:
+        """Fetch the ban of `user`, raising `discord.NotFound` if they aren't banned."""
+        await self.rest.request("guild.fetch_ban")
+        if user.id not in self.bans:
+            raise not_found("Unknown Ban")
+        return SimpleNamespace(user=user, reason=None)
+
+    async def kick(self, user: FakeUser, *, reason: t.Optional[str] = None) -> None:
+        """Kick `user` from the guild."""
+        await self.rest.request("guild.kick")
+        if user.id not in self._members:
+            raise not_found("Unknown Member")
+        self.remove_member(user.id)
+
+    def get_role(self, role_id: int) -> t.Optional[FakeRole]:
+        """Get a role of the guild."""
+        return self.roles.get(role_id)
+
+    def get_channel(self, channel_id: int) -> t.Optional[t.Union[FakeTextChannel, FakeCategory]]:
+        """Get a channel of the guild from the cache."""
+        if channel_id in self._deleted_channels:
+            return None
+        return self._channels_by_id.get(channel_id)
+
+    async def fetch_channels(self) -> list[t.Union[FakeTextChannel, FakeCategory]]:
+        """Fetch all channels of the guild from the API."""
+        await self.rest.request("guild.fetch_channels")
+        return [channel for channel in self.channels if channel.id not in self._deleted_channels]
+
+
+class FakeMessage:
+    """A message sent by a moderator in a thread channel."""
+
+    def __init__(self, channel: FakeTextChannel, content: str, *, attachments: t.Sequence[object] = ()):
+        self.id = next_id()
+        self.channel = channel
+        self.content = content
+        self.attachments = list(attachments)
+        self.reactions: list[str] = []
+
+    async def add_reaction(self, emoji: str) -> None:
+        """React to the message."""
+        await self.channel.guild.rest.request("message.react")
+        self.reactions.append(emoji)
+
+
+class FakeThread:
+    """A modmail thread between a recipient and the thread channel."""
+
+    def __init__(self, recipient: FakeUser, channel: FakeTextChannel):
+        self.id = recipient.id
+        self.recipient = recipient
+        self.channel = channel
+
+
+class FakeThreadManager:
+    """Look up the open modmail threads."""
+
+    def __init__(self):
+        self.threads: dict[int, FakeThread] = {}
+
+    def add(self, thread: FakeThread) -> FakeThread:
+        """Open `thread`."""
+        self.threads[thread.recipient.id] = thread
+        return thread
+
+    async def find(self, *, recipient: t.Optional[FakeUser] = None, channel: object = None) -> t.Optional[FakeThread]:
+        """Find the open thread of `recipient` or of `channel`."""
+        if recipient is not None:
+            return self.threads.get(recipient.id)
+        return discord.utils.find(lambda thread: thread.channel == channel, self.threads.values())
+
+
+def _matches(document: dict, query: dict) -> bool:
+    """Whether `document` matches the `query`, only equality and comparison operators are supported."""
+    operators = {
+        "$eq": lambda value, expected: value == expected,
+        "$ne": lambda value, expected: value != expected,
+        "$gt": lambda value, expected: value is not None and value > expected,
+        "$gte": lambda value, expected: value is not None and value >= expected,
+        "$lt": lambda value, expected: value is not None and value < expected,
+        "$lte": lambda value, expected: value is not None and value <= expected,
+        "$in": lambda value, expected: value in expected,
+    }
+    for key, condition in query.items():
+        value = document.get(key)
+        if isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+            if not all(operators[op](value, expected) for op, expected in condition.items()):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _apply_update(document: dict, update: dict) -> None:
+    """Apply the `$set`, `$setOnInsert`, `$addToSet`, `$pull` and `$inc` operators of `update` in place."""
+    for field_name, value in update.get("$set", {}).items():
+        document[field_name] = copy.deepcopy(value)
+    for field_name, value in update.get("$inc", {}).items():
+        document[field_name] = document.get(field_name, 0) + value
+    for field_name, value in update.get("$addToSet", {}).items():
+        values = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+        array = document.setdefault(field_name, [])
+        array.extend(copy.deepcopy(item) for item in values if item not in array)
+    for field_name, value in update.get("$pull", {}).items():
+        values = value["$in"] if isinstance(value, dict) and "$in" in value else [value]
+        if field_name in document:
+            document[field_name] = [item for item in document[field_name] if item not in values]
+
+
+class FakeCollection:
+    """An in-memory collection with the subset of the motor API used by the plugins."""
+
+    def __init__(self, latency: float = 0.0, operations: t.Optional[Counter] = None):
+        self.latency = latency
+        self.operations: Counter[str] = Counter() if operations is None else operations
+        self.documents: dict[object, dict] = {}
+        self.indexes: list[tuple[object, dict]] = []
+
+    async def _operation(self, name: str) -> None:
+        self.operations[name] += 1
+        await asyncio.sleep(self.latency)
+
+    def _find(self, query: dict) -> t.Optional[dict]:
+        if "_id" in query and not isinstance(query["_id"], dict):
+            document = self.documents.get(query["_id"])
+            return document if document is not None and _matches(document, query) else None
+        return next((document for document in self.documents.values() if _matches(document, query)), None)
+
+    def _upsert(self, query: dict, update: dict) -> dict:
+        document = {key: value for key, value in query.items() if not isinstance(value, dict)}
+        document.setdefault("_id", next_id())
+        if document["_id"] in self.documents:
+            raise DuplicateKeyError(f"E11000 duplicate key error, _id: {document['_id']!r}")
+        _apply_update(document, update)
+        _apply_update(document, {"$set": update.get("$setOnInsert", {})})
+        self.documents[document["_id"]] = document
+        return document
+
+    def _update(self, query: dict, update: dict, upsert: bool) -> t.Tuple[t.Optional[dict], t.Optional[dict]]:
+        """Apply `update` to the first document matching `query`, returning it before and after."""
+        document = self._find(query)
+        if document is None:
+            return None, self._upsert(query, update) if upsert else None
+        before = copy.deepcopy(document)
+        _apply_update(document, update)
+        return before, document
+
+    async def find_one(self, query: dict) -> t.Optional[dict]:
+        """Return a copy of the first document matching `query`."""
+        await self._operation("find_one")
+        return copy.deepcopy(self._find(query))
+
+    async def find_one_and_update(
+        self, query: dict, update: dict, *, upsert: bool = False, return_document: bool = False
+    ) -> t.Optional[dict]:
+        """Update the first document matching `query`, returning it as it was before the update by default."""
+        await self._operation("find_one_and_update")
+        before, after = self._update(query, update, upsert)
+        return copy.deepcopy(after if return_document else before)
+
+    async def update_one(self, query: dict, update: dict, *, upsert: bool = False) -> None:
+        """Update the first document matching `query`."""
+        await self._operation("update_one")
+        self._update(query, update, upsert)
+
+    async def insert_one(self, document: dict) -> None:
+        """Insert `document`."""
+        await self._operation("insert_one")
+        self._upsert(document, {})
+
+    async def delete_one(self, query: dict) -> None:
+        """Delete the first document matching `query`."""
+        await self._operation("delete_one")
+        if document := self._find(query):
+            del self.documents[document["_id"]]
+
+    async def bulk_write(self, operations: t.Sequence[object], *, ordered: bool = True) -> None:
+        """Apply a list of `pymongo.UpdateOne` operations."""
+        await self._operation("bulk_write")
+        for operation in operations:
+            self.operations["bulk_write.operations"] += 1
+            self._update(operation._filter, operation._doc, operation._upsert)
+
+    async def create_index(self, keys: object, **kwargs) -> None:
+        """Record the creation of an index, TTL indexes aren't enforced."""
+        await self._operation("create_index")
+        self.indexes.append((keys, kwargs))
+
+
+class FakeDatabase:
+    """The plugin partitions of the database, and the thread logs."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.operations: Counter[str] = Counter()
+        self.partitions: dict[str, FakeCollection] = {}
+        self.logs: dict[int, dict] = {}
+
+    def get_partition(self, cog: object) -> FakeCollection:
+        """Return the collection of `cog`, like `bot.plugin_db.get_partition`."""
+        return self.partition(type(cog).__name__)
+
+    def partition(self, name: str) -> FakeCollection:
+        """Return the collection of the cog called `name`."""
+        if name not in self.partitions:
+            self.partitions[name] = FakeCollection(self.latency, self.operations)
+        return self.partitions[name]
+
+    # Named after `bot.api.get_plugin_partition`, which the ping manager uses.
+    get_plugin_partition = get_partition
+
+    async def get_log(self, channel_id: int) -> dict:
+        """Return the log of the thread in `channel_id`."""
+        self.operations["get_log"] += 1
+        await asyncio.sleep(self.latency)
+        return self.logs.get(channel_id, {"messages": []})
+
+
+class FakeBot:
+    """The parts of `ModmailBot` used by the plugins."""
+
+    def __init__(self, *, rest_latency: float = 0.0, db_latency: float = 0.0):
+        self.rest = FakeRest(rest_latency)
+        self.db = FakeDatabase(db_latency)
+        self.api = self.db
+        self.plugin_db = self.db
+        self.threads = FakeThreadManager()
+        self.config = {
+            "recipient_thread_close": False,
+            "thread_creation_footer": "Your message has been sent",
+            "thread_self_closable_creation_footer": "Click the lock to close the thread",
+        }
+        self.mod_color = 0x7289DA
+        self.error_color = 0xE74C3C
+        self.guild = FakeGuild(self.rest, name="Python Discord")
+        self.guilds: dict[int, FakeGuild] = {self.guild.id: self.guild}
+        self.ready = asyncio.Event()
+        self.ready.set()
+
+    def add_guild(self, guild: FakeGuild) -> FakeGuild:
+        """Add `guild` to the guilds the bot is in."""
+        self.guilds[guild.id] = guild
+        return guild
+
+    def get_guild(self, guild_id: int) -> t.Optional[FakeGuild]:
+        """Get a guild the bot is in."""
+        return self.guilds.get(guild_id)
+
+    def get_channel(self, channel_id: int) -> t.Optional[t.Union[FakeTextChannel, FakeCategory]]:
+        """Get a channel of any guild the bot is in."""
+        for guild in self.guilds.values():
+            if channel := guild.get_channel(channel_id):
+                return channel
+        return None
+
+    async def wait_until_ready(self) -> None:
+        """Wait for the bot to be ready, which it is unless `ready` is cleared."""
+        await self.ready.wait()
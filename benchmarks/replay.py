@@ -0,0 +1,413 @@
+"""
+Replay gateway event traces into the plugins under a virtual clock.
+
+A trace is a JSONL file with one event per line, in order of their `at` field, the number of
+seconds since the start of the trace. The supported events are:
+
+- `member_join` / `member_remove`: `user` joined or left the `guild`, either `pydis` or `appeals`.
+  A joining member can be given `roles`, a list of role ids.
+- `ban` / `unban`: `user` got banned or unbanned from PyDis.
+- `thread_ready`: a modmail thread got opened by `user`.
+- `mod_message`: a mod sent a reply in the thread of `user`, or an internal message if `internal` is true.
+- `thread_close`: the thread of `user` got closed and its channel deleted.
+- `restart`: the bot restarted, being down for `downtime` seconds.
+
+Run `python -m benchmarks.replay --help` to generate traces, replay them and compare the results of two runs.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import random
+import sys
+import time
+import typing as t
+from collections import Counter
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from benchmarks import fakes, results
+from benchmarks.clock import VirtualClockLoop, patch_datetime, virtual_datetime
+
+# Module and cog class of each plugin the harness can load.
+PLUGINS = {
+    "ban_appeals": ("ban_appeals.ban_appeals", "BanAppeals"),
+    "ping_manager": ("ping_manager.ping_manager", "PingManager"),
+}
+
+# Seconds of virtual time to keep running after the last event, so pending pings go out.
+DEFAULT_SETTLE = 2 * 60 * 60
+
+# Relative increase of API calls or db operations reported as a regression.
+DEFAULT_TOLERANCE = 0.1
+
+# Start of the virtual clock, fixed so that runs of the same trace give the same results.
+EPOCH = datetime(2022, 1, 1)
+
+
+def load_trace(path: str) -> list[dict]:
+    """Load the events of the JSONL trace at `path`."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class Replay:
+    """Replay trace events into freshly loaded plugins backed by the fakes."""
+
+    def __init__(
+        self,
+        plugins: t.Iterable[str] = tuple(PLUGINS),
+        *,
+        rest_latency: float = 0.05,
+        db_latency: float = 0.005,
+        route_limits: bool = True,
+        member_cache: bool = True,
+    ):
+        self.plugin_names = list(plugins)
+        self.modules = {name: importlib.import_module(PLUGINS[name][0]) for name in self.plugin_names}
+
+        self.bot = fakes.FakeBot(rest_latency=rest_latency, db_latency=db_latency)
+        # All the plugins share the scheduler, so any plugin's copy of the module can create it.
+        rest_scheduler = importlib.import_module(f"{self.plugin_names[0]}.utils.rest_scheduler")
+        scheduler = rest_scheduler.RestScheduler(route_limits=None if route_limits else {})
+        setattr(self.bot, rest_scheduler.SCHEDULER_ATTRIBUTE, scheduler)
+
+        self.pydis = self.bot.guild
+        appeals_id = getattr(self.modules.get("ban_appeals"), "APPEAL_GUILD_ID", None)
+        self.appeals = self.bot.add_guild(fakes.FakeGuild(self.bot.rest, appeals_id, name="Appeals"))
+        self.appeals.chunked = member_cache
+        self.logs_channel = self.appeals.add_channel(fakes.FakeTextChannel(self.appeals, name="logs"))
+        self.threads_category = self.pydis.add_channel(fakes.FakeCategory(self.pydis, name="Threads"))
+        self.appeal_category = self.pydis.add_channel(fakes.FakeCategory(self.pydis, name="Appeals"))
+        self.users: dict[int, fakes.FakeUser] = {}
+        self.opened_at: dict[int, float] = {}
+
+        self.cogs: list[object] = []
+        self.listener_tasks: list[asyncio.Task] = []
+        self._setup_plugins()
+
+    def _setup_plugins(self) -> None:
+        """Store the configuration the plugins need in the fakes."""
+        if "ban_appeals" in self.modules:
+            self.bot.db.partition("BanAppeals").documents["ban-appeal-categories"] = {
+                "_id": "ban-appeal-categories",
+                "categories": [self.appeal_category.id],
+            }
+        if "ping_manager" in self.modules:
+            module = self.modules["ping_manager"]
+            self.pydis.roles[module.MOD_TEAM_ROLE_ID] = fakes.FakeRole(module.MOD_TEAM_ROLE_ID)
+
+    def _user(self, user_id: int) -> fakes.FakeUser:
+        if user_id not in self.users:
+            self.users[user_id] = fakes.FakeUser(self.bot.rest, user_id)
+        return self.users[user_id]
+
+    async def load(self) -> None:
+        """Load every plugin, as the bot does when starting."""
+        for name in self.plugin_names:
+            _, class_name = PLUGINS[name]
+            cog = getattr(self.modules[name], class_name)(self.bot)
+            await cog.cog_load()
+            self.cogs.append(cog)
+
+    async def unload(self) -> None:
+        """Wait for the running listeners and unload every plugin."""
+        await asyncio.gather(*self.listener_tasks, return_exceptions=True)
+        self.listener_tasks.clear()
+        for cog in reversed(self.cogs):
+            await cog.cog_unload()
+        self.cogs.clear()
+
+    def dispatch(self, event: str, *args) -> None:
+        """Run the listeners of `event` of every plugin in their own task, like discord.py does."""
+        for cog in self.cogs:
+            for name, listener in cog.get_listeners():
+                if name == f"on_{event}":
+                    self.listener_tasks.append(asyncio.create_task(listener(*args)))
+
+    async def handle(self, event: dict) -> None:
+        """Apply the trace `event` to the fakes and dispatch it to the plugins."""
+        kind = event["event"]
+        user = self._user(event["user"]) if "user" in event else None
+
+        if kind in ("member_join", "member_remove"):
+            guild = self.appeals if event["guild"] == "appeals" else self.pydis
+            if kind == "member_join":
+                roles = [fakes.FakeRole(role_id) for role_id in event.get("roles", ())]
+                member = guild.add_member(fakes.FakeMember(guild, user.id, roles=roles), joined=True)
+                self.dispatch("member_join", member)
+            else:
+                # Like discord.py, only dispatch `member_remove` for cached members, and always the raw event.
+                member = guild.get_member(user.id)
+                guild.remove_member(user.id)
+                if member is not None:
+                    self.dispatch("member_remove", member)
+                self.dispatch("raw_member_remove", SimpleNamespace(user=member or user, guild_id=guild.id))
+        elif kind == "ban":
+            self.pydis.bans.add(user.id)
+            self.pydis.remove_member(user.id)
+        elif kind == "unban":
+            self.pydis.bans.discard(user.id)
+        elif kind == "thread_ready":
+            channel = self.pydis.add_channel(fakes.FakeTextChannel(self.pydis, category=self.threads_category))
+            thread = self.bot.threads.add(fakes.FakeThread(user, channel))
+            self.opened_at[channel.id] = asyncio.get_running_loop().time()
+            self.dispatch("thread_ready", thread)
+        elif kind == "mod_message":
+            if thread := self.bot.threads.threads.get(user.id):
+                message_type = "internal" if event.get("internal") else "thread_message"
+                log = self.bot.db.logs.setdefault(thread.channel.id, {"messages": []})
+                log["messages"].append({"author": {"mod": True}, "type": message_type})
+        elif kind == "thread_close":
+            if thread := self.bot.threads.threads.pop(user.id, None):
+                self.pydis.delete_channel(thread.channel.id)
+                self.dispatch("thread_close", thread)
+        elif kind == "restart":
+            await self.unload()
+            await asyncio.sleep(event.get("downtime", 0))
+            await self.load()
+        else:
+            raise ValueError(f"Unknown event {kind!r}.")
+
+    async def run(self, events: list[dict], *, settle: float = DEFAULT_SETTLE) -> dict[str, object]:
+        """Replay `events`, then keep running for `settle` seconds and return the outcome of the run."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await self.load()
+        for event in events:
+            delay = start + event["at"] - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.handle(event)
+        await asyncio.sleep(settle)
+        await self.unload()
+        return self.outcome()
+
+    def outcome(self) -> dict[str, object]:
+        """Summarise what the plugins did during the run."""
+        channels = [channel for channel in self.pydis.channels if isinstance(channel, fakes.FakeTextChannel)]
+        first_ping = []
+        pings = 0
+        for channel in channels:
+            ping_times = [
+                sent_at for message, sent_at in zip(channel.messages, channel.sent_at)
+                if message["content"] and "@here" in message["content"]
+            ]
+            pings += len(ping_times)
+            if ping_times:
+                opened_at = EPOCH + timedelta(seconds=self.opened_at[channel.id])
+                first_ping.append((ping_times[0] - opened_at).total_seconds())
+
+        recorder = results.LatencyRecorder()
+        recorder.samples = first_ping
+        return {
+            "latency_ms": recorder.percentiles(),
+            "outcome": {
+                "threads": len(channels),
+                "pings": pings,
+                "pinged_threads": len(first_ping),
+                "moved_to_appeals": len(self.appeal_category.channels),
+                "appeals_members": self.appeals.member_count,
+                "dms": sum(len(user.dms) for user in self.users.values()),
+                "logs": len(self.logs_channel.messages),
+            },
+        }
+
+
+def replay(
+    trace_path: str,
+    *,
+    plugins: t.Iterable[str] = tuple(PLUGINS),
+    rest_latency: float = 0.05,
+    db_latency: float = 0.005,
+    route_limits: bool = True,
+    member_cache: bool = True,
+    settle: float = DEFAULT_SETTLE,
+) -> results.Result:
+    """Replay the trace at `trace_path` in a virtual clock loop, returning the result of the run."""
+    events = load_trace(trace_path)
+    loop = VirtualClockLoop()
+    try:
+        wall_start = time.perf_counter()
+        harness = Replay(
+            plugins,
+            rest_latency=rest_latency,
+            db_latency=db_latency,
+            route_limits=route_limits,
+            member_cache=member_cache,
+        )
+        with patch_datetime([fakes, *harness.modules.values()], virtual_datetime(loop, EPOCH)):
+            run = loop.run_until_complete(harness.run(events, settle=settle))
+        wall_time = time.perf_counter() - wall_start
+    finally:
+        loop.close()
+
+    return results.Result(
+        scenario=f"replay:{trace_path}",
+        parameters={
+            "rest_latency": rest_latency,
+            "db_latency": db_latency,
+            "route_limits": route_limits,
+            "member_cache": member_cache,
+        },
+        operations=len(events),
+        duration=loop.time(),
+        latency_ms=run["latency_ms"],
+        api_calls=dict(harness.bot.rest.calls),
+        db_operations=dict(harness.bot.db.operations),
+        outcome={**run["outcome"], "wall_time": round(wall_time, 3)},
+    )
+
+
+def generate(kind: str, count: int, seed: int = 0) -> list[dict]:
+    """
+    Generate a trace of `count` users.
+
+    - `raid`: users flood the appeals server, most of them aren't banned and get kicked.
+    - `thread_burst`: users open threads within a minute, mods reply to some of them.
+    - `overdue_backlog`: users open threads, then the bot is down for an hour.
+    - `flapping`: banned users open threads, then repeatedly leave and rejoin the appeals server.
+    """
+    rng = random.Random(seed)
+    user_ids = [fakes.next_id() for _ in range(count)]
+    events = []
+
+    if kind == "raid":
+        for user_id in user_ids:
+            at = rng.uniform(0, 60)
+            if rng.random() < 0.1:
+                events.append({"at": at, "event": "ban", "user": user_id})
+                events.append({"at": at + 1, "event": "thread_ready", "user": user_id})
+            events.append({"at": at + 2, "event": "member_join", "guild": "appeals", "user": user_id})
+            if rng.random() < 0.2:
+                left_at = at + rng.uniform(3, 600)
+                events.append({"at": left_at, "event": "member_remove", "guild": "appeals", "user": user_id})
+    elif kind in ("thread_burst", "overdue_backlog"):
+        for user_id in user_ids:
+            at = rng.uniform(0, 60)
+            if rng.random() < 0.1:
+                events.append({"at": at, "event": "ban", "user": user_id})
+            events.append({"at": at + 1, "event": "thread_ready", "user": user_id})
+            reply = rng.random()
+            if reply < 0.4:
+                # A third of the messages are internal, and only delay the ping.
+                message = {"at": at + rng.uniform(2, 300), "event": "mod_message", "user": user_id}
+                events.append({**message, "internal": reply >= 0.3})
+            if rng.random() < 0.1:
+                events.append({"at": at + rng.uniform(60, 3600), "event": "thread_close", "user": user_id})
+        if kind == "overdue_backlog":
+            events.append({"at": 120, "event": "restart", "downtime": 3600})
+    elif kind == "flapping":
+        for user_id in user_ids:
+            at = rng.uniform(0, 60)
+            events.append({"at": at, "event": "ban", "user": user_id})
+            events.append({"at": at + 1, "event": "thread_ready", "user": user_id})
+            for _ in range(rng.randint(1, 5)):
+                at += rng.uniform(0.1, 1)
+                events.append({"at": at + 1, "event": "member_join", "guild": "appeals", "user": user_id})
+                at += rng.uniform(0.1, 1)
+                events.append({"at": at + 1, "event": "member_remove", "guild": "appeals", "user": user_id})
+    else:
+        raise ValueError(f"Unknown trace kind {kind!r}.")
+
+    return sorted(events, key=lambda event: event["at"])
+
+
+def compare(baseline: list[dict], current: list[dict], tolerance: float = DEFAULT_TOLERANCE) -> list[str]:
+    """
+    Compare two lists of results, returning the list of regressions found.
+
+    Outcomes must be identical, and the number of API calls or db operations of any route
+    must not grow by more than `tolerance`.
+    """
+    problems = []
+    baseline_by_scenario = {result["scenario"]: result for result in baseline}
+    for result in current:
+        scenario = result["scenario"]
+        if scenario not in baseline_by_scenario:
+            continue
+        base = baseline_by_scenario[scenario]
+
+        for key, value in result["outcome"].items():
+            if key != "wall_time" and base["outcome"].get(key) != value:
+                problems.append(f"{scenario}: outcome {key} changed from {base['outcome'].get(key)} to {value}")
+
+        for counts in ("api_calls", "db_operations"):
+            before, after = Counter(base[counts]), Counter(result[counts])
+            for key in sorted(before.keys() | after.keys()):
+                if after[key] > before[key] * (1 + tolerance):
+                    problems.append(f"{scenario}: {counts} {key} went from {before[key]} to {after[key]}")
+            if sum(after.values()) > sum(before.values()) * (1 + tolerance):
+                problems.append(
+                    f"{scenario}: total {counts} went from {sum(before.values())} to {sum(after.values())}"
+                )
+    return problems
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay event traces into the plugins under a virtual clock.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser("generate", help="Write a generated trace to stdout.")
+    generate_parser.add_argument("kind", choices=("raid", "thread_burst", "overdue_backlog", "flapping"))
+    generate_parser.add_argument("--count", type=int, default=1000, help="Number of users in the trace.")
+    generate_parser.add_argument("--seed", type=int, default=0)
+
+    run_parser = subparsers.add_parser("run", help="Replay traces.")
+    run_parser.add_argument("traces", nargs="+")
+    run_parser.add_argument("--plugins", nargs="+", choices=tuple(PLUGINS), default=list(PLUGINS))
+    run_parser.add_argument("--rest-latency", type=float, default=0.05)
+    run_parser.add_argument("--db-latency", type=float, default=0.005)
+    run_parser.add_argument("--no-route-limits", action="store_true", help="Don't apply Discord's route limits.")
+    run_parser.add_argument(
+        "--no-member-cache", action="store_true", help="Don't cache the members of the appeals server."
+    )
+    run_parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE, help="Seconds to run after the trace.")
+    run_parser.add_argument("--json", metavar="PATH", help="Write the results to a JSON file.")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare the JSON results of two runs.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Run the replay command given on the command line."""
+    args = _parse_args()
+    if args.command == "generate":
+        for event in generate(args.kind, args.count, args.seed):
+            print(json.dumps(event))
+    elif args.command == "run":
+        logging.disable(logging.INFO)
+        run_results = []
+        for trace in args.traces:
+            result = replay(
+                trace,
+                plugins=args.plugins,
+                rest_latency=args.rest_latency,
+                db_latency=args.db_latency,
+                route_limits=not args.no_route_limits,
+                member_cache=not args.no_member_cache,
+                settle=args.settle,
+            )
+            print(result.format())
+            run_results.append(result)
+        if args.json:
+            results.dump(run_results, args.json)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        problems = compare(baseline, current, args.tolerance)
+        for problem in problems:
+            print(problem)
+        if problems:
+            sys.exit(1)
+        print("No regressions found.")
+
+
+if __name__ == "__main__":
+    main()
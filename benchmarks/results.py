@@ -0,0 +1,86 @@
+import json
+import time
+import typing as t
+from dataclasses import asdict, dataclass, field
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(samples: t.Sequence[float], percent: float) -> float:
+    """Return the `percent` percentile of `samples`, using the nearest-rank method."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class LatencyRecorder:
+    """Record how long each call of an async function takes."""
+
+    def __init__(self):
+        self.samples: list[float] = []
+
+    def wrap(self, func: t.Callable[..., t.Awaitable]) -> t.Callable[..., t.Awaitable]:
+        """Return `func` wrapped to record the duration of every call."""
+        async def timed(*args, **kwargs) -> object:
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.samples.append(time.perf_counter() - start)
+        return timed
+
+    def percentiles(self) -> dict[str, float]:
+        """Return the percentiles of the recorded durations, in milliseconds."""
+        return {f"p{percent}": percentile(self.samples, percent) * 1000 for percent in PERCENTILES}
+
+
+@dataclass
+class Result:
+    """The outcome of a benchmark scenario."""
+
+    scenario: str
+    parameters: dict[str, object]
+    operations: int
+    duration: float
+    latency_ms: dict[str, float] = field(default_factory=dict)
+    api_calls: dict[str, int] = field(default_factory=dict)
+    db_operations: dict[str, int] = field(default_factory=dict)
+    outcome: dict[str, object] = field(default_factory=dict)
+
+    @property
+    def throughput(self) -> float:
+        """Operations per second."""
+        return self.operations / self.duration if self.duration else 0.0
+
+    def to_dict(self) -> dict[str, object]:
+        """Return the result as a JSON serialisable dict."""
+        return {**asdict(self), "throughput": self.throughput}
+
+    def format(self) -> str:
+        """Return a human readable summary of the result."""
+        parameters = ", ".join(f"{key}={value}" for key, value in self.parameters.items())
+        lines = [
+            f"{self.scenario} ({parameters})",
+            f"  {self.operations} operations in {self.duration:.3f}s, {self.throughput:.1f} ops/s",
+        ]
+        if self.latency_ms:
+            lines.append("  latency: " + ", ".join(f"{key}={value:.2f}ms" for key, value in self.latency_ms.items()))
+        if self.api_calls:
+            lines.append(f"  API calls ({sum(self.api_calls.values())}): " + _format_counts(self.api_calls))
+        if self.db_operations:
+            lines.append(f"  db operations ({sum(self.db_operations.values())}): " + _format_counts(self.db_operations))
+        if self.outcome:
+            lines.append("  outcome: " + ", ".join(f"{key}={value}" for key, value in self.outcome.items()))
+        return "\n".join(lines)
+
+
+def _format_counts(counts: dict[str, int]) -> str:
+    return ", ".join(f"{key}={value}" for key, value in sorted(counts.items()))
+
+
+def dump(results: t.Iterable[Result], path: str) -> None:
+    """Write `results` to the JSON file at `path`."""
+    with open(path, "w") as f:
+        json.dump([result.to_dict() for result in results], f, indent=2)
@@ -0,0 +1,415 @@
+"""
+Benchmark scenarios running the plugins against the fakes.
+
+The plugins import modules of the modmail bot (`bot`, `core`), so the benchmarks need to
+run with a modmail checkout on the python path.
+"""
+import asyncio
+import random
+import sys
+import time
+import tracemalloc
+import types
+import typing as t
+from collections import Counter
+from dataclasses import asdict
+from datetime import datetime, timedelta
+
+from benchmarks import fakes
+from benchmarks.results import LatencyRecorder, Result
+
+# Maximum time to wait for the pings of a scenario to be sent.
+PING_TIMEOUT = 600
+
+
+def _set_scheduler(bot: fakes.FakeBot, rest_scheduler: types.ModuleType, route_limits: bool) -> None:
+    """
+    Give `bot` a REST scheduler from the plugin's `rest_scheduler` module.
+
+    Unless `route_limits` is True, the scheduler doesn't apply Discord's route limits,
+    which would otherwise make most scenarios wait on the logs channel for hours.
+    """
+    scheduler = rest_scheduler.RestScheduler(route_limits=None if route_limits else {})
+    setattr(bot, rest_scheduler.SCHEDULER_ATTRIBUTE, scheduler)
+
+
+def _ban_appeals_env(
+    members: int,
+    banned_ratio: float,
+    thread_ratio: float,
+    *,
+    rest_latency: float,
+    db_latency: float,
+    route_limits: bool,
+    seed: int,
+    chunked: bool = True,
+) -> tuple[fakes.FakeBot, fakes.FakeGuild]:
+    """
+    Return a bot with an appeals guild of `members` members, `banned_ratio` of them banned in PyDis.
+
+    Unless `chunked` is True, the bot doesn't have a member cache of the appeals guild.
+    """
+    from ban_appeals import ban_appeals
+    from ban_appeals.utils import rest_scheduler
+
+    rng = random.Random(seed)
+    bot = fakes.FakeBot(rest_latency=rest_latency, db_latency=db_latency)
+    _set_scheduler(bot, rest_scheduler, route_limits)
+    pydis = bot.guild
+    appeals = bot.add_guild(fakes.FakeGuild(bot.rest, ban_appeals.APPEAL_GUILD_ID, name="Appeals"))
+    appeals.chunked = chunked
+    appeals.add_channel(fakes.FakeTextChannel(appeals, name="logs"))
+    category = pydis.add_channel(fakes.FakeCategory(pydis, name="Appeals 1"))
+    bot.db.partition("BanAppeals").documents["ban-appeal-categories"] = {
+        "_id": "ban-appeal-categories",
+        "categories": [category.id],
+    }
+    threads_category = pydis.add_channel(fakes.FakeCategory(pydis, name="Threads"))
+
+    staff_role = fakes.FakeRole(ban_appeals.PYDIS_NO_KICK_ROLE_IDS[0])
+    for _ in range(members):
+        member = appeals.add_member(fakes.FakeMember(appeals))
+        if rng.random() < banned_ratio:
+            pydis.bans.add(member.id)
+        elif rng.random() < 0.01:
+            pydis.add_member(fakes.FakeMember(pydis, member.id, roles=[staff_role]))
+        if rng.random() < thread_ratio:
+            channel = pydis.add_channel(fakes.FakeTextChannel(pydis, category=threads_category))
+            bot.threads.add(fakes.FakeThread(member, channel))
+    return bot, appeals
+
+
+async def sync_kicks(
+    members: int = 10_000,
+    *,
+    banned_ratio: float = 0.8,
+    thread_ratio: float = 0.05,
+    rest_latency: float = 0.0,
+    db_latency: float = 0.0,
+    route_limits: bool = False,
+    seed: int = 0,
+    chunked: bool = True,
+) -> Result:
+    """
+    Run a full `BanAppeals._sync_kicks` sweep over an appeals guild of `members` members.
+
+    Unless `chunked` is True, the appeals guild has no member cache and the sweep streams its members.
+    """
+    from ban_appeals import ban_appeals
+
+    bot, appeals = _ban_appeals_env(
+        members,
+        banned_ratio,
+        thread_ratio,
+        rest_latency=rest_latency,
+        db_latency=db_latency,
+        route_limits=route_limits,
+        seed=seed,
+        chunked=chunked,
+    )
+    cog = ban_appeals.BanAppeals(bot)
+    recorder = LatencyRecorder()
+    cog._maybe_kick_user = recorder.wrap(cog._maybe_kick_user)
+
+    bot.ready.clear()
+    await cog.cog_load()
+    sweep = cog.tasks.get_task(cog.qualified_name, "sync-kicks")
+    bot.db.operations.clear()
+    start = time.perf_counter()
+    bot.ready.set()
+    await sweep
+    duration = time.perf_counter() - start
+    await cog.cog_unload()
+
+    return Result(
+        scenario="ban_appeals.sync_kicks",
+        parameters={
+            "members": members, "banned_ratio": banned_ratio, "rest_latency": rest_latency, "chunked": chunked
+        },
+        operations=members,
+        duration=duration,
+        latency_ms=recorder.percentiles(),
+        api_calls=dict(bot.rest.calls),
+        db_operations=dict(bot.db.operations),
+        outcome={"kicked": members - appeals.member_count, "remaining": appeals.member_count},
+    )
+
+
+def _size_of(objects: t.Iterable[object]) -> int:
+    """Return the size in bytes of `objects`, their attributes and their lists of roles."""
+    size = 0
+    for obj in objects:
+        size += sys.getsizeof(obj)
+        if attributes := getattr(obj, "__dict__", None):
+            size += sys.getsizeof(attributes) + sum(map(sys.getsizeof, attributes.values()))
+            size += sum(map(sys.getsizeof, attributes.get("roles", ())))
+    return size
+
+
+async def member_memory(
+    members: int = 100_000,
+    *,
+    banned_ratio: float = 0.8,
+    seed: int = 0,
+) -> Result:
+    """
+    Compare the memory held for the appeals guild's members with and without its member cache.
+
+    The member cache is measured as the size of the fake members, real discord.py members are
+    larger. Without the cache, what's held is the set of ids kept by `BanAppeals`. The peak is the
+    most memory allocated at once during a `_sync_kicks` sweep, as traced by `tracemalloc`.
+    """
+    from ban_appeals import ban_appeals
+
+    outcome = {}
+    api_calls = Counter()
+    duration = 0.0
+    for chunked in (True, False):
+        mode = "cached" if chunked else "bounded"
+        bot, appeals = _ban_appeals_env(
+            members, banned_ratio, 0.0, rest_latency=0.0, db_latency=0.0, route_limits=False, seed=seed, chunked=chunked
+        )
+        cog = ban_appeals.BanAppeals(bot)
+        bot.ready.clear()
+        await cog.cog_load()
+        sweep = cog.tasks.get_task(cog.qualified_name, "sync-kicks")
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        bot.ready.set()
+        await sweep
+        duration += time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        if chunked:
+            held = sys.getsizeof(appeals._members) + _size_of(appeals.members)
+        else:
+            held = sys.getsizeof(cog.appeals_member_ids) + _size_of(cog.appeals_member_ids)
+        await cog.cog_unload()
+
+        api_calls.update(bot.rest.calls)
+        outcome[f"{mode}_held_kib"] = round(held / 1024)
+        outcome[f"{mode}_sweep_peak_kib"] = round((peak - baseline) / 1024)
+        outcome[f"{mode}_remaining"] = appeals.member_count
+
+    return Result(
+        scenario="ban_appeals.member_memory",
+        parameters={"members": members, "banned_ratio": banned_ratio},
+        operations=members * 2,
+        duration=duration,
+        api_calls=dict(api_calls),
+        outcome=outcome,
+    )
+
+
+async def ping_backlog(
+    tasks: int = 10_000,
+    *,
+    spread: float = 5.0,
+    replied_ratio: float = 0.3,
+    rest_latency: float = 0.0,
+    db_latency: float = 0.0,
+    route_limits: bool = False,
+    seed: int = 0,
+) -> Result:
+    """
+    Load `PingManager` with `tasks` pending ping tasks due within `spread` seconds.
+
+    `replied_ratio` of the threads have a reply from a mod, and shouldn't get pinged.
+    Latency is how late each ping was sent compared to when it was due.
+    """
+    from ping_manager import ping_manager
+    from ping_manager.utils import rest_scheduler
+
+    rng = random.Random(seed)
+    bot = fakes.FakeBot(rest_latency=rest_latency, db_latency=db_latency)
+    _set_scheduler(bot, rest_scheduler, route_limits)
+    pydis = bot.guild
+    pydis.roles[ping_manager.MOD_TEAM_ROLE_ID] = fakes.FakeRole(ping_manager.MOD_TEAM_ROLE_ID)
+    category = pydis.add_channel(fakes.FakeCategory(pydis, name="Threads"))
+
+    now = datetime.utcnow()
+    ping_tasks = []
+    for _ in range(tasks):
+        channel = pydis.add_channel(fakes.FakeTextChannel(pydis, category=category))
+        if rng.random() < replied_ratio:
+            bot.db.logs[channel.id] = {"messages": [{"author": {"mod": True}, "type": "thread_message"}]}
+        when_to_ping = now + timedelta(seconds=rng.uniform(0, spread))
+        ping_tasks.append(ping_manager.PingTask(when_to_ping=when_to_ping.isoformat(), channel_id=channel.id))
+
+    bot.db.partition("PingManager").documents["ping-delay-tasks"] = {
+        "_id": "ping-delay-tasks",
+        "ping_tasks": [asdict(task) for task in ping_tasks],
+    }
+
+    cog = ping_manager.PingManager(bot)
+    start = time.perf_counter()
+    await cog.cog_load()
+    deadline = start + spread + PING_TIMEOUT
+    while cog.ping_tasks and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    duration = time.perf_counter() - start
+    await cog.cog_unload()
+
+    lateness = []
+    for task in ping_tasks:
+        channel = bot.get_channel(task.channel_id)
+        if channel.sent_at:
+            lateness.append((channel.sent_at[0] - datetime.fromisoformat(task.when_to_ping)).total_seconds())
+    recorder = LatencyRecorder()
+    recorder.samples = lateness
+
+    return Result(
+        scenario="ping_manager.ping_backlog",
+        parameters={"tasks": tasks, "spread": spread, "rest_latency": rest_latency, "db_latency": db_latency},
+        operations=tasks,
+        duration=duration,
+        latency_ms=recorder.percentiles(),
+        api_calls=dict(bot.rest.calls),
+        db_operations=dict(bot.db.operations),
+        outcome={"pinged": len(lateness), "not_pinged": tasks - len(lateness), "left_pending": len(cog.ping_tasks)},
+    )
+
+
+async def reply_cooldown(
+    threads: int = 500,
+    *,
+    messages_per_thread: int = 20,
+    duplicate_ratio: float = 0.2,
+    rest_latency: float = 0.0,
+    seed: int = 0,
+) -> Result:
+    """
+    Reply in `threads` threads at the same time, with `duplicate_ratio` of the replies sent twice in a row.
+
+    Latency is the time taken by each call of the patched `Thread.reply`.
+    """
+    from core.thread import Thread
+    from reply_cooldown import reply_cooldown
+
+    rng = random.Random(seed)
+    bot = fakes.FakeBot(rest_latency=rest_latency)
+    pydis = bot.guild
+    sent: list[fakes.FakeMessage] = []
+
+    async def original_reply(self: Thread, message: fakes.FakeMessage, *args, **kwargs) -> None:
+        await bot.rest.request("thread.reply")
+        sent.append(message)
+
+    recorder = LatencyRecorder()
+    previous_reply = Thread.reply
+    Thread.reply = original_reply
+    cog = reply_cooldown.ReplyCooldown(bot)
+    try:
+        await cog.cog_load()
+        reply = recorder.wrap(Thread.reply)
+
+        duplicates = 0
+        conversations = []
+        for _ in range(threads):
+            channel = pydis.add_channel(fakes.FakeTextChannel(pydis))
+            thread = fakes.FakeThread(fakes.FakeUser(bot.rest), channel)
+            messages = []
+            for index in range(messages_per_thread):
+                messages.append(fakes.FakeMessage(channel, f"reply {index}"))
+                if rng.random() < duplicate_ratio:
+                    messages.append(fakes.FakeMessage(channel, f"reply {index}"))
+                    duplicates += 1
+            conversations.append((thread, messages))
+
+        async def converse(thread: fakes.FakeThread, messages: list[fakes.FakeMessage]) -> None:
+            for message in messages:
+                await reply(thread, message)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(converse(thread, messages) for thread, messages in conversations))
+        duration = time.perf_counter() - start
+    finally:
+        await cog.cog_unload()
+        Thread.reply = previous_reply
+
+    blocked = sum(bool(message.reactions) for _, messages in conversations for message in messages)
+    return Result(
+        scenario="reply_cooldown.concurrent_threads",
+        parameters={"threads": threads, "messages_per_thread": messages_per_thread, "rest_latency": rest_latency},
+        operations=len(recorder.samples),
+        duration=duration,
+        latency_ms=recorder.percentiles(),
+        api_calls=dict(bot.rest.calls),
+        outcome={"replies_sent": len(sent), "duplicates": duplicates, "blocked": blocked},
+    )
+
+
+async def reply_cooldown_replicas(
+    threads: int = 500,
+    *,
+    replicas: int = 2,
+    messages_per_thread: int = 20,
+    duplicate_ratio: float = 0.2,
+    db_latency: float = 0.0,
+    seed: int = 0,
+) -> Result:
+    """
+    Send replies through `replicas` bots sharing a database, with each reply going to a random bot.
+
+    Duplicates are counted with the cooldown local to each bot, then shared through the database.
+    Latency is the time taken by each cooldown check of the shared run.
+    """
+    from reply_cooldown import reply_cooldown
+
+    rng = random.Random(seed)
+    pydis = fakes.FakeGuild(fakes.FakeRest())
+    conversations = []
+    duplicates = 0
+    for _ in range(threads):
+        channel = fakes.FakeTextChannel(pydis)
+        for index in range(messages_per_thread):
+            conversations.append((rng.randrange(replicas), fakes.FakeMessage(channel, f"reply {index}")))
+            if rng.random() < duplicate_ratio:
+                conversations.append((rng.randrange(replicas), fakes.FakeMessage(channel, f"reply {index}")))
+                duplicates += 1
+
+    outcome = {"duplicates": duplicates}
+    recorder = LatencyRecorder()
+    duration = 0.0
+    db_operations = {}
+    for shared in (False, True):
+        store = fakes.FakeCollection(db_latency)
+        cogs = []
+        for _ in range(replicas):
+            bot = fakes.FakeBot(db_latency=db_latency)
+            bot.db.partitions["ReplyCooldown"] = store
+            cog = reply_cooldown.ReplyCooldown(bot)
+            cog.shared = shared
+            cogs.append(cog)
+
+        is_duplicate = [recorder.wrap(cog.is_duplicate) if shared else cog.is_duplicate for cog in cogs]
+        start = time.perf_counter()
+        blocked = 0
+        for replica, message in conversations:
+            blocked += await is_duplicate[replica](message)
+        if shared:
+            duration = time.perf_counter() - start
+            db_operations = dict(store.operations)
+        outcome[f"blocked_{'shared' if shared else 'local'}"] = blocked
+
+    return Result(
+        scenario="reply_cooldown.replicas",
+        parameters={"threads": threads, "replicas": replicas, "db_latency": db_latency},
+        operations=len(conversations),
+        duration=duration,
+        latency_ms=recorder.percentiles(),
+        db_operations=db_operations,
+        outcome=outcome,
+    )
+
+
+SCENARIOS: dict[str, t.Callable[..., t.Awaitable[Result]]] = {
+    "sync_kicks": sync_kicks,
+    "member_memory": member_memory,
+    "ping_backlog": ping_backlog,
+    "reply_cooldown": reply_cooldown,
+    "reply_cooldown_replicas": reply_cooldown_replicas,
+}
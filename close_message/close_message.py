@@ -60,7 +60,11 @@ class CloseMessage(commands.Cog):
 
     def __init__(self, bot: ModmailBot) -> None:
         self.bot = bot
-        self.close_command = self.bot.get_command('close')
+
+    @property
+    def close_command(self) -> commands.Command:
+        """The built-in close command, looked up on use as it may not be loaded yet when this plugin is."""
+        return self.bot.get_command('close')
 
     @commands.group(
         name="closemessage",
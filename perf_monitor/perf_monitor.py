@@ -0,0 +1,288 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import time
+import typing as t
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+
+from discord.ext import commands
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from bot import ModmailBot
+from core import checks
+from core.models import PermissionLevel, getLogger
+from core.thread import Thread
+
+# Number of spans kept per span name to compute percentiles over.
+SPAN_HISTORY = 1000
+# Number of finished spans, of any name, kept to find the culprits of event loop lag.
+RECENT_SPANS = 200
+# Seconds between two measurements of the event loop lag.
+LAG_INTERVAL = 0.5
+# Number of lag measurements kept to compute percentiles over.
+LAG_HISTORY = 1200
+# Lag in seconds over which the slowest recent spans are logged.
+LAG_THRESHOLD = 0.25
+# Number of spans logged when the event loop lags.
+SLOW_SPANS_LOGGED = 5
+# Number of span names shown by the perf command.
+SPANS_SHOWN = 15
+
+# Attributes of the bot holding the task supervisor and the REST scheduler shared by the other plugins,
+# their `SUPERVISOR_ATTRIBUTE` and `SCHEDULER_ATTRIBUTE`.
+SUPERVISOR_ATTRIBUTE = "_pydis_task_supervisor_v1"
+SCHEDULER_ATTRIBUTE = "_pydis_rest_scheduler_v1"
+
+# Motor collection methods timed as db calls.
+DB_METHODS = (
+    "bulk_write",
+    "count_documents",
+    "create_index",
+    "delete_many",
+    "delete_one",
+    "find_one",
+    "find_one_and_delete",
+    "find_one_and_replace",
+    "find_one_and_update",
+    "insert_many",
+    "insert_one",
+    "replace_one",
+    "update_many",
+    "update_one",
+)
+
+log = getLogger(__name__)
+
+# Marks an attribute that was inherited rather than set on the patched object itself.
+_INHERITED = object()
+
+
+@dataclass(eq=False)
+class Span:
+    """Timings of a single run of a listener, command or patched method."""
+
+    name: str
+    parent: t.Optional["Span"] = field(default=None, repr=False)
+    started: float = field(default_factory=time.perf_counter)
+    ended: t.Optional[float] = None
+    rest_time: float = 0.0
+    rest_calls: int = 0
+    db_time: float = 0.0
+    db_calls: int = 0
+
+    @property
+    def wall_time(self) -> float:
+        """Seconds between the start and the end of the span, or now if it's still running."""
+        return (self.ended or time.perf_counter()) - self.started
+
+    def finish(self) -> None:
+        """End the span, and count its REST and db calls in its parent span if that one is still running."""
+        self.ended = time.perf_counter()
+        if self.parent and self.parent.ended is None:
+            self.parent.rest_time += self.rest_time
+            self.parent.rest_calls += self.rest_calls
+            self.parent.db_time += self.db_time
+            self.parent.db_calls += self.db_calls
+
+
+_current_span: contextvars.ContextVar[t.Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def _percentile(samples: t.Sequence[float], percent: float) -> float:
+    """Return the `percent` percentile of `samples`, using the nearest-rank method."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))]
+
+
+class PerfMonitor(commands.Cog):
+    """A plugin tracing the time taken by every listener and command, and the event loop lag."""
+
+    def __init__(self, bot: ModmailBot):
+        self.bot = bot
+        self._lag_monitor: t.Optional[asyncio.Task] = None
+
+        self.spans: defaultdict[str, deque[Span]] = defaultdict(lambda: deque(maxlen=SPAN_HISTORY))
+        self.recent_spans: deque[Span] = deque(maxlen=RECENT_SPANS)
+        self.active_spans: set[Span] = set()
+        self.lag_samples: deque[float] = deque(maxlen=LAG_HISTORY)
+
+        # (object, attribute, original value, replacement) of everything patched, to restore on unload.
+        self._patches: list[tuple[object, str, object, object]] = []
+        self._tracing = False
+
+    async def cog_load(self) -> None:
+        """Start tracing, and monitoring the event loop lag."""
+        self._patch(self.bot, "_run_event", self._traced_run_event(self.bot._run_event))
+        self._patch(self.bot, "invoke", self._traced_invoke(self.bot.invoke))
+        self._patch(Thread, "reply", self._traced_method(Thread.reply, "thread.reply"))
+        self._patch(self.bot.http, "request", self._timed_call(self.bot.http.request, "rest"))
+        for method in DB_METHODS:
+            self._patch(AsyncIOMotorCollection, method, self._timed_call(getattr(AsyncIOMotorCollection, method), "db"))
+        self._tracing = True
+
+        self._lag_monitor = asyncio.create_task(self._monitor_lag())
+
+    async def cog_unload(self) -> None:
+        """Stop tracing and restore everything that got patched."""
+        self._tracing = False
+        if self._lag_monitor:
+            self._lag_monitor.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._lag_monitor
+        for obj, attribute, original, replacement in reversed(self._patches):
+            if vars(obj).get(attribute) is not replacement:
+                # Something else wrapped our patch since, leave it in place as it stops tracing on its own.
+                continue
+            if original is _INHERITED:
+                delattr(obj, attribute)
+            else:
+                setattr(obj, attribute, original)
+        self._patches.clear()
+
+    def _patch(self, obj: object, attribute: str, replacement: object) -> None:
+        """Set `attribute` of `obj` to `replacement`, keeping the original to restore it on unload."""
+        original = vars(obj).get(attribute, _INHERITED)
+        self._patches.append((obj, attribute, original, replacement))
+        setattr(obj, attribute, replacement)
+
+    @contextlib.contextmanager
+    def _span(self, name: str) -> t.Iterator[Span]:
+        """Record a span called `name` around the body of the `with` statement."""
+        if not self._tracing:
+            yield Span(name)
+            return
+
+        span = Span(name, parent=_current_span.get())
+        token = _current_span.set(span)
+        self.active_spans.add(span)
+        try:
+            yield span
+        finally:
+            _current_span.reset(token)
+            self.active_spans.discard(span)
+            span.finish()
+            self.spans[name].append(span)
+            self.recent_spans.append(span)
+
+    def _traced_run_event(self, run_event: t.Callable[..., t.Awaitable[None]]) -> t.Callable[..., t.Awaitable[None]]:
+        """Wrap the bot's `_run_event`, which runs every listener of every dispatched event."""
+        @functools.wraps(run_event)
+        async def traced(coro: t.Callable, event_name: str, *args, **kwargs) -> None:
+            with self._span(f"listener:{getattr(coro, '__qualname__', event_name)}"):
+                await run_event(coro, event_name, *args, **kwargs)
+        return traced
+
+    def _traced_invoke(self, invoke: t.Callable[[commands.Context], t.Awaitable[None]]) -> t.Callable:
+        """Wrap the bot's `invoke`, which runs every command."""
+        @functools.wraps(invoke)
+        async def traced(ctx: commands.Context) -> None:
+            name = ctx.command.qualified_name if ctx.command else "unknown"
+            with self._span(f"command:{name}"):
+                await invoke(ctx)
+        return traced
+
+    def _traced_method(self, method: t.Callable[..., t.Awaitable], name: str) -> t.Callable[..., t.Awaitable]:
+        """Wrap an async method so each call is recorded as a span called `name`."""
+        @functools.wraps(method)
+        async def traced(*args, **kwargs) -> object:
+            with self._span(name):
+                return await method(*args, **kwargs)
+        return traced
+
+    def _timed_call(self, func: t.Callable[..., t.Awaitable], kind: str) -> t.Callable[..., t.Awaitable]:
+        """Wrap a REST or db call so its duration is added to the current span."""
+        @functools.wraps(func)
+        async def timed(*args, **kwargs) -> object:
+            span = _current_span.get()
+            # Tasks created during a span inherit it, but their calls made after it ended aren't part of it.
+            if span is None or span.ended is not None or not self._tracing:
+                return await func(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                # The call may have outlived the span, when made by a task spawned during it.
+                if span.ended is None and kind == "rest":
+                    span.rest_time += time.perf_counter() - start
+                    span.rest_calls += 1
+                elif span.ended is None:
+                    span.db_time += time.perf_counter() - start
+                    span.db_calls += 1
+        return timed
+
+    async def _monitor_lag(self) -> None:
+        """Measure how late the event loop wakes up from a sleep, logging the slowest spans when it's too late."""
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LAG_INTERVAL
+            await asyncio.sleep(LAG_INTERVAL)
+            lag = loop.time() - expected
+            self.lag_samples.append(lag)
+            if lag < LAG_THRESHOLD:
+                continue
+
+            window_start = time.perf_counter() - LAG_INTERVAL - lag
+            candidates = [span for span in self.recent_spans if span.ended >= window_start]
+            candidates.extend(self.active_spans)
+            slowest = sorted(candidates, key=lambda span: span.wall_time, reverse=True)[:SLOW_SPANS_LOGGED]
+            log.warning(
+                "Event loop lagged %.3fs, slowest recent spans: %s",
+                lag,
+                ", ".join(f"{span.name} ({span.wall_time * 1000:.1f}ms)" for span in slowest) or "none",
+            )
+
+    def _span_table(self) -> list[str]:
+        """Return the lines of a table of the percentiles of the spans with the highest p95."""
+        rows = []
+        for name, spans in self.spans.items():
+            wall_times = [span.wall_time * 1000 for span in spans]
+            rows.append((
+                _percentile(wall_times, 95),
+                f"{name[:40]:<40} {len(spans):>5} {_percentile(wall_times, 50):>8.1f} "
+                f"{_percentile(wall_times, 95):>8.1f} {_percentile(wall_times, 99):>8.1f} "
+                f"{sum(span.rest_time for span in spans) * 1000 / len(spans):>7.1f} "
+                f"{sum(span.db_time for span in spans) * 1000 / len(spans):>7.1f} "
+                f"{sum(span.rest_calls + span.db_calls for span in spans) / len(spans):>5.1f}"
+            ))
+        rows.sort(reverse=True)
+        header = (
+            f"{'span':<40} {'count':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'rest ms':>7} {'db ms':>7} {'calls':>5}"
+        )
+        return [header, *(row for _, row in rows[:SPANS_SHOWN])]
+
+    @commands.command()
+    @checks.has_permissions(PermissionLevel.ADMINISTRATOR)
+    async def perf(self, ctx: commands.Context) -> None:
+        """Show the recent percentiles of the time taken by listeners and commands, and of the event loop lag."""
+        lag_ms = [lag * 1000 for lag in self.lag_samples]
+        lines = [
+            *self._span_table(),
+            "",
+            f"event loop lag: p50={_percentile(lag_ms, 50):.1f}ms p95={_percentile(lag_ms, 95):.1f}ms "
+            f"p99={_percentile(lag_ms, 99):.1f}ms max={max(lag_ms, default=0):.1f}ms",
+        ]
+        # The task supervisor and the REST scheduler are only there if a plugin using them is loaded.
+        if supervisor := getattr(self.bot, SUPERVISOR_ATTRIBUTE, None):
+            lines.append(
+                f"background tasks: {supervisor.live_tasks()} live, "
+                f"{sum(stats.failed for stats in supervisor.stats.values())} failed"
+            )
+        if scheduler := getattr(self.bot, SCHEDULER_ATTRIBUTE, None):
+            lines.append("REST queue: " + ", ".join(
+                f"{int(priority)}: {stats.queued} queued, {stats.mean_wait * 1000:.1f}ms mean wait"
+                for priority, stats in scheduler.stats.items()
+            ))
+
+        output = "\n".join(lines)
+        await ctx.send(f"```\n{output[:1980]}\n```")
+
+
+async def setup(bot: ModmailBot) -> None:
+    """Add the PerfMonitor plugin."""
+    await bot.add_cog(PerfMonitor(bot))
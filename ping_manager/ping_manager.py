@@ -10,9 +10,16 @@ from bot import ModmailBot
 from core import checks
 from core.models import PermissionLevel, getLogger
 from core.thread import Thread
+from .utils import async_tasks, db_buffer, load_timer, rest_scheduler, thread_classification
+from .utils.rest_scheduler import Priority
+from .utils.thread_classification import ThreadClassification
 
 # Remove view perms from this role while pining, so only on-duty mods get the ping.
 MOD_TEAM_ROLE_ID = 267629731250176001
+# Maximum number of pings being checked and sent at the same time, e.g. when a backlog is overdue.
+PING_DELIVERY_CONCURRENCY = 5
+# Number of stored ping tasks started between two yields to the event loop on load.
+PING_STARTUP_BATCH = 100
 log = getLogger(__name__)
 
 
@@ -47,23 +54,54 @@ class PingManager(commands.Cog):
         self.config: t.Optional[PingConfig] = None
         self.ping_tasks: list[PingTask] = None
         self.db = bot.api.get_plugin_partition(self)
+        self.tasks = async_tasks.get_supervisor(bot)
+        self.db_writes = db_buffer.WriteBehindBuffer(self.db, self.tasks, self.qualified_name)
+        self.rest = rest_scheduler.get_scheduler(bot)
+        self.classifier = thread_classification.get_classifier(bot)
 
     async def cog_load(self) -> None:
-        """Fetch the current config from the db."""
-        db_config = await self.db.find_one({"_id": "ping-delay-config"})
+        """
+        Fetch the current config and the stored ping tasks from the db.
+
+        The stored tasks are only started once the bot is ready, so they don't hold up the load.
+        """
+        timer = load_timer.LoadTimer(self.qualified_name)
+        with timer.phase("db"):
+            db_config, db_ping_tasks = await asyncio.gather(
+                self.db.find_one({"_id": "ping-delay-config"}),
+                self.db.find_one({"_id": "ping-delay-tasks"}),
+            )
         db_config = db_config or {}
         self.config = PingConfig(**db_config)
 
         self.mod_team_role = self.bot.guild.get_role(MOD_TEAM_ROLE_ID)
 
-        db_ping_tasks = await self.db.find_one({"_id": "ping-delay-tasks"})
         db_ping_tasks = db_ping_tasks or {}
         self.ping_tasks = [PingTask(**task) for task in db_ping_tasks.get("ping_tasks", [])]
 
         log.info("Loaded config: %s", self.config)
         log.info("Loaded %d ping tasks", len(self.ping_tasks))
-        for task in self.ping_tasks:
-            asyncio.create_task(self.maybe_ping_later(task))
+        self.tasks.set_limit(self.qualified_name, "ping-delivery", PING_DELIVERY_CONCURRENCY)
+        self.db_writes.start()
+        self.tasks.spawn(
+            self.qualified_name, self._start_stored_pings(list(self.ping_tasks)), name="start-stored-pings"
+        )
+        timer.log()
+
+    async def _start_stored_pings(self, stored_tasks: list[PingTask]) -> None:
+        """Start the ping tasks loaded from the db once the bot is ready, yielding to the event loop between batches."""
+        await self.bot.wait_until_ready()
+        timer = load_timer.LoadTimer(self.qualified_name)
+        for index, task in enumerate(stored_tasks, start=1):
+            self._schedule_ping(task)
+            if index % PING_STARTUP_BATCH == 0:
+                await asyncio.sleep(0)
+        timer.log(f"Started {len(stored_tasks)} stored ping tasks of")
+
+    async def cog_unload(self) -> None:
+        """Cancel all pending ping tasks, they are restarted from the db on the next load."""
+        await self.tasks.cancel_all(self.qualified_name)
+        await self.db_writes.close()
 
     @commands.group(invoke_without_command=True)
     @checks.has_permissions(PermissionLevel.SUPPORTER)
@@ -81,10 +119,10 @@ class PingManager(commands.Cog):
     @checks.has_permissions(PermissionLevel.OWNER)
     async def set_initial(self, ctx: commands.Context, wait_duration: int) -> None:
         """Set the number of seconds to wait after a thread is opened to ping."""
-        await self.db.find_one_and_update(
-            {"_id": "ping-delay-config"},
+        await self.db_writes.update(
+            "ping-delay-config",
             {"$set": {"initial_wait_duration": wait_duration}},
-            upsert=True,
+            durable=True,
         )
         self.config.initial_wait_duration = wait_duration
         await ctx.send(f":+1: Set initial ping delay to {wait_duration} seconds.")
@@ -93,10 +131,10 @@ class PingManager(commands.Cog):
     @checks.has_permissions(PermissionLevel.OWNER)
     async def set_delayed(self, ctx: commands.Context, wait_duration: int) -> None:
         """Set the number of seconds to wait after a thread is opened to ping."""
-        await self.db.find_one_and_update(
-            {"_id": "ping-delay-config"},
+        await self.db_writes.update(
+            "ping-delay-config",
             {"$set": {"delayed_wait_duration": wait_duration}},
-            upsert=True,
+            durable=True,
         )
         self.config.delayed_wait_duration = wait_duration
         await ctx.send(f":+1: Set the delayed ping delay to {wait_duration} seconds.")
@@ -120,10 +158,10 @@ class PingManager(commands.Cog):
     @ping_string.command(name="set")
     async def set_ping(self, ctx: commands.Context, ping_string: str) -> None:
         """Set what to send after a waiting for a thread to be responded to."""
-        await self.db.find_one_and_update(
-            {"_id": "ping-delay-config"},
+        await self.db_writes.update(
+            "ping-delay-config",
             {"$set": {"ping_string": ping_string}},
-            upsert=True,
+            durable=True,
         )
         self.config.ping_string = ping_string
         await ctx.send(f":+1: Set ping string to {ping_string}.", allowed_mentions=None)
@@ -148,12 +186,12 @@ class PingManager(commands.Cog):
             await ctx.send(f":x: {category_to_ignore} already in the ignored categories.")
             return
 
-        self.config.ignored_categories.append(category_to_ignore.id)
-        await self.db.find_one_and_update(
-            {"_id": "ping-delay-config"},
+        await self.db_writes.update(
+            "ping-delay-config",
             {"$addToSet": {"ignored_categories": category_to_ignore.id}},
-            upsert=True,
+            durable=True,
         )
+        self.config.ignored_categories.append(category_to_ignore.id)
 
         await ctx.send(f":+1: Added {category_to_ignore} to the ignored categories list.")
 
@@ -176,33 +214,34 @@ class PingManager(commands.Cog):
             await ctx.send(f":x: {category_to_ignore} isn't in the ignored categories list.")
             return
 
-        self.config.ignored_categories.remove(category_to_ignore.id)
-        await self.db.find_one_and_update(
-            {"_id": "ping-delay-config"},
+        await self.db_writes.update(
+            "ping-delay-config",
             {"$pull": {"ignored_categories": category_to_ignore.id}},
-            upsert=True,
+            durable=True,
         )
+        self.config.ignored_categories.remove(category_to_ignore.id)
         await ctx.send(f":+1: Removed {category_to_ignore} from the ignored categories list.")
 
     async def add_ping_task(self, task: PingTask) -> None:
         """Adds a ping task to the internal cache and to the db."""
         self.ping_tasks.append(task)
-        await self.db.find_one_and_update(
-            {"_id": "ping-delay-tasks"},
-            {"$addToSet": {"ping_tasks": asdict(task)}},
-            upsert=True,
-        )
+        await self.db_writes.update("ping-delay-tasks", {"$addToSet": {"ping_tasks": asdict(task)}})
 
-        asyncio.create_task(self.maybe_ping_later(task))
+        self._schedule_ping(task)
+
+    def _schedule_ping(self, task: PingTask) -> None:
+        """Start the background task waiting to ping for `task`."""
+        self.tasks.spawn(
+            self.qualified_name,
+            self.maybe_ping_later(task),
+            name=f"ping-{task.channel_id}-{task.when_to_ping}",
+            group="ping",
+        )
 
     async def remove_ping_task(self, task: PingTask) -> None:
         """Removes a ping task to the internal cache and to the db."""
         self.ping_tasks.remove(task)
-        await self.db.find_one_and_update(
-            {"_id": "ping-delay-tasks"},
-            {"$pull": {"ping_tasks": asdict(task)}},
-            upsert=True,
-        )
+        await self.db_writes.update("ping-delay-tasks", {"$pull": {"ping_tasks": asdict(task)}})
 
     async def should_ping(self, channel: discord.TextChannel, already_delayed: bool) -> bool:
         """Check if a ping should be sent to a thread depending on current config."""
@@ -250,6 +289,11 @@ class PingManager(commands.Cog):
         else:
             await asyncio.sleep(seconds_to_sleep)
 
+        async with self.tasks.limit(self.qualified_name, "ping-delivery"):
+            await self._ping(ping_task)
+
+    async def _ping(self, ping_task: PingTask) -> None:
+        """Send the ping for `ping_task` if it is still needed, and remove the task."""
         if not (channel := self.bot.get_channel(ping_task.channel_id)):
             log.info("Channel closed before we could ping.")
             await self.remove_ping_task(ping_task)
@@ -258,22 +302,50 @@ class PingManager(commands.Cog):
             try:
                 if await self.should_ping(channel, ping_task.already_delayed):
                     # Remove overwrites for off-duty mods, ping, then add back.
-                    await channel.set_permissions(self.mod_team_role, overwrite=None)
-                    await channel.send(
+                    await self.rest.call(
+                        Priority.PING,
+                        f"channel.permissions:{channel.id}",
+                        channel.set_permissions,
+                        self.mod_team_role,
+                        overwrite=None,
+                    )
+                    await self.rest.call(
+                        Priority.PING,
+                        f"channel.send:{channel.id}",
+                        channel.send,
                         f"{self.config.ping_string}"
-                        f"{' no one has replied yet!' if ping_task.already_delayed else ''}"
+                        f"{' no one has replied yet!' if ping_task.already_delayed else ''}",
+                    )
+                    await self.rest.call(
+                        Priority.PING, f"channel.edit:{channel.id}", channel.edit, sync_permissions=True
                     )
-                    await channel.edit(sync_permissions=True)
             except discord.NotFound:
                 # Fail silently if the channel gets deleted during processing.
                 pass
-            finally:
+            except asyncio.CancelledError:
+                # The cog is being unloaded, keep the stored task so the ping is started again on load.
+                raise
+            except Exception:
                 # Ensure the task always gets removed.
                 await self.remove_ping_task(ping_task)
+                raise
+            await self.remove_ping_task(ping_task)
 
     @commands.Cog.listener()
     async def on_thread_ready(self, thread: Thread, *args) -> None:
         """Schedule a task to check if the bot should ping in the thread after the defined wait duration."""
+        # Classify the thread with the other plugins, so a thread about to be moved
+        # is checked against the category it ends up in.
+        try:
+            classification = await self.classifier.classify(thread)
+        except Exception:
+            # A failed appeal check mustn't drop the ping, fall back to where the thread is now.
+            log.exception("Failed to classify %s, scheduling its ping based on its current category.", thread.channel)
+            classification = ThreadClassification.regular(thread)
+        if classification.category_id in self.config.ignored_categories:
+            log.info("Not scheduling a ping in %s as it's going to an ignored category", thread.channel)
+            return
+
         now = datetime.utcnow()
         ping_task = PingTask(
             when_to_ping=(now + timedelta(seconds=self.config.initial_wait_duration)).isoformat(),
@@ -281,6 +353,11 @@ class PingManager(commands.Cog):
         )
         await self.add_ping_task(ping_task)
 
+    @commands.Cog.listener()
+    async def on_thread_close(self, thread: Thread, *args) -> None:
+        """Forget the classification of the closed thread."""
+        self.classifier.forget(thread.channel.id)
+
 
 async def setup(bot: ModmailBot) -> None:
     """Add the PingManager plugin."""
@@ -1,11 +1,33 @@
+"""
+Supervise the background tasks of plugins, with a supervisor shared by every plugin through the bot.
+
+Each plugin ships its own copy of this module. The supervisor is stored on the bot under an attribute
+including `SUPERVISOR_VERSION`, so plugins installed at refs with different versions don't use a
+supervisor they don't know the interface of. Bump the version on any change to `TaskSupervisor`.
+
+Reloading a plugin, e.g. with `?plugin update`, doesn't replace a supervisor of the same version, which
+keeps running the code it was created with until the bot restarts. Supervisors of older versions are
+dropped from the bot once they have no live tasks, the plugins still using them keep their reference.
+"""
 import asyncio
 import contextlib
+import functools
+import time
 import typing as t
+from collections import defaultdict
+from dataclasses import dataclass
 
 from core.models import getLogger
 
+if t.TYPE_CHECKING:
+    from bot import ModmailBot
+
 log = getLogger(__name__)
 
+# Version of `TaskSupervisor`, part of the attribute of the bot holding the supervisor shared by every plugin.
+SUPERVISOR_VERSION = 1
+SUPERVISOR_ATTRIBUTE = f"_pydis_task_supervisor_v{SUPERVISOR_VERSION}"
+
 
 def create_task(
     coro: t.Awaitable,
@@ -14,9 +36,7 @@ def create_task(
     """
     Wrapper for creating asyncio `Task`s which logs exceptions raised in the task.
 
-    If the loop kwarg is provided, the task is created from that event loop,
-    the loop does not need to be running to add a task to it.
-    Otherwise the running loop is used.
+    If the loop kwarg is provided, the task is created from that event loop, otherwise the running loop is used.
     """
     if event_loop is not None:
         task = event_loop.create_task(coro)
@@ -33,3 +53,156 @@ def _log_task_exception(task: asyncio.Task, *args) -> None:
         # Log the exception if one exists.
         if exception:
             log.error(f"Error in task {task.get_name()} {id(task)}!", exc_info=exception)
+
+
+@contextlib.asynccontextmanager
+async def _no_limit() -> t.AsyncIterator[None]:
+    """Do nothing, for groups without a concurrency limit."""
+    # `contextlib.nullcontext` only supports `async with` since Python 3.10.
+    yield
+
+
+@dataclass
+class TaskGroupStats:
+    """Counters for the tasks spawned in one task group of a cog."""
+
+    started: int = 0
+    completed: int = 0
+    failed: int = 0
+    cancelled: int = 0
+    live: int = 0
+    total_run_time: float = 0.0
+    max_run_time: float = 0.0
+
+    def record(self, run_time: float, outcome: str) -> None:
+        """Record that a task finished after `run_time` seconds with the given `outcome`."""
+        self.live -= 1
+        self.total_run_time += run_time
+        self.max_run_time = max(self.max_run_time, run_time)
+        if outcome == "failed":
+            self.failed += 1
+        elif outcome == "cancelled":
+            self.cancelled += 1
+        else:
+            self.completed += 1
+
+
+class TaskSupervisor:
+    """
+    Keep track of the background tasks spawned by cogs.
+
+    Tasks are registered by name under the cog that owns them so they can all be cancelled
+    when that cog is unloaded. Each (cog, group) pair can have a concurrency limit, and keeps
+    counters of how many tasks ran, how long they took and how many failed.
+
+    A single supervisor is shared by every plugin through `get_supervisor`.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: dict[str, dict[str, asyncio.Task]] = defaultdict(dict)
+        self._limits: dict[tuple[str, str], asyncio.Semaphore] = {}
+        self.stats: dict[tuple[str, str], TaskGroupStats] = defaultdict(TaskGroupStats)
+        # Time at which each running task got a slot of its group's limit and started running.
+        self._run_starts: dict[asyncio.Task, float] = {}
+
+    def set_limit(self, owner: str, group: str, limit: int) -> None:
+        """Allow at most `limit` tasks of `group` owned by `owner` to run at once."""
+        self._limits[(owner, group)] = asyncio.Semaphore(limit)
+
+    def limit(self, owner: str, group: str) -> t.AsyncContextManager:
+        """
+        Return an async context manager holding a slot of the group's concurrency limit.
+
+        This can be used to only limit part of a task, e.g. after a long sleep.
+        """
+        semaphore = self._limits.get((owner, group))
+        return semaphore if semaphore is not None else _no_limit()
+
+    def spawn(self, owner: str, coro: t.Coroutine, *, name: str, group: str = "default") -> asyncio.Task:
+        """
+        Schedule `coro` as a task called `name` owned by `owner`.
+
+        If a task with the same name is still running for that owner, `coro` is closed
+        and the running task is returned instead.
+        """
+        tasks = self._tasks[owner]
+        if (existing := tasks.get(name)) and not existing.done():
+            log.debug("Task %s of %s is already running, not spawning it again.", name, owner)
+            coro.close()
+            return existing
+
+        task = create_task(self._run(owner, group, coro))
+        task.set_name(f"{owner}:{name}")
+        tasks[name] = task
+        self.stats[(owner, group)].started += 1
+        self.stats[(owner, group)].live += 1
+        task.add_done_callback(functools.partial(self._finish, owner, group, name, coro))
+        return task
+
+    def _finish(self, owner: str, group: str, name: str, coro: t.Coroutine, task: asyncio.Task) -> None:
+        """
+        Record the outcome of a finished task, and remove it from the registry unless it has already been replaced.
+
+        This runs even if the task was cancelled before it started, in which case `coro` is closed.
+        """
+        coro.close()
+        start = self._run_starts.pop(task, None)
+        run_time = time.perf_counter() - start if start is not None else 0.0
+        if task.cancelled():
+            outcome = "cancelled"
+        elif task.exception():
+            outcome = "failed"
+        else:
+            outcome = "completed"
+        self.stats[(owner, group)].record(run_time, outcome)
+
+        tasks = self._tasks.get(owner, {})
+        if tasks.get(name) is task:
+            del tasks[name]
+
+    async def _run(self, owner: str, group: str, coro: t.Coroutine) -> None:
+        """Run `coro` within the group's concurrency limit."""
+        async with self.limit(owner, group):
+            # Don't count the time spent waiting for a slot as run time.
+            self._run_starts[asyncio.current_task()] = time.perf_counter()
+            await coro
+
+    def get_task(self, owner: str, name: str) -> t.Optional[asyncio.Task]:
+        """Return the running task called `name` owned by `owner`, if there is one."""
+        return self._tasks.get(owner, {}).get(name)
+
+    def live_tasks(self, owner: t.Optional[str] = None) -> int:
+        """Return the number of running tasks, either for `owner` or for every cog."""
+        if owner is not None:
+            return sum(not task.done() for task in self._tasks.get(owner, {}).values())
+        return sum(self.live_tasks(owner) for owner in list(self._tasks))
+
+    @property
+    def idle(self) -> bool:
+        """Whether no task is running."""
+        return not self.live_tasks()
+
+    async def cancel_all(self, owner: str) -> None:
+        """Cancel every task owned by `owner` and wait for them to finish."""
+        tasks = list(self._tasks.pop(owner, {}).values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            log.info("Cancelled %d background tasks of %s.", len(tasks), owner)
+        for key in [key for key in self._limits if key[0] == owner]:
+            del self._limits[key]
+
+
+def get_supervisor(bot: "ModmailBot") -> TaskSupervisor:
+    """Return the task supervisor shared by all plugins, creating it if needed, and drop idle older ones."""
+    for version in range(1, SUPERVISOR_VERSION):
+        attribute = f"_pydis_task_supervisor_v{version}"
+        if getattr(getattr(bot, attribute, None), "idle", False):
+            delattr(bot, attribute)
+
+    supervisor = getattr(bot, SUPERVISOR_ATTRIBUTE, None)
+    if supervisor is None:
+        supervisor = TaskSupervisor()
+        setattr(bot, SUPERVISOR_ATTRIBUTE, supervisor)
+    return supervisor
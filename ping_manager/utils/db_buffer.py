@@ -0,0 +1,216 @@
+import asyncio
+import typing as t
+from dataclasses import dataclass, field
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from core.models import getLogger
+
+if t.TYPE_CHECKING:
+    from motor.motor_asyncio import AsyncIOMotorCollection
+
+    from .async_tasks import TaskSupervisor
+
+log = getLogger(__name__)
+
+SUPPORTED_OPERATORS = ("$set", "$addToSet", "$pull")
+
+
+def _values(value: object, modifier: str) -> list:
+    """Return the list of values of an `$addToSet`/`$pull` update, unwrapping `$each`/`$in`."""
+    if isinstance(value, dict) and list(value) == [modifier]:
+        return list(value[modifier])
+    return [value]
+
+
+@dataclass
+class _PendingUpdate:
+    """The merged, not yet written, updates of a single document."""
+
+    to_set: dict[str, t.Any] = field(default_factory=dict)
+    add_to_set: dict[str, list] = field(default_factory=dict)
+    pull: dict[str, list] = field(default_factory=dict)
+
+    def merge(self, update: dict[str, dict]) -> bool:
+        """
+        Merge `update` into the pending update.
+
+        Return False without merging anything if `update` can't be merged, because it
+        both sets and adds to/pulls from the same field.
+        """
+        for operator, fields in update.items():
+            if operator not in SUPPORTED_OPERATORS:
+                raise ValueError(f"Unsupported update operator {operator!r}.")
+            for field_name in fields:
+                if operator == "$set" and (field_name in self.add_to_set or field_name in self.pull):
+                    return False
+                if operator != "$set" and field_name in self.to_set:
+                    return False
+
+        for field_name, value in update.get("$set", {}).items():
+            self.to_set[field_name] = value
+        for field_name, value in update.get("$addToSet", {}).items():
+            self._move(_values(value, "$each"), self.pull.get(field_name, []), self.add_to_set, field_name)
+        for field_name, value in update.get("$pull", {}).items():
+            self._move(_values(value, "$in"), self.add_to_set.get(field_name, []), self.pull, field_name)
+        return True
+
+    @staticmethod
+    def _move(values: list, cancelled: list, target: dict[str, list], field_name: str) -> None:
+        """Add `values` to the `target` field, removing them from the `cancelled` operation."""
+        pending = target.setdefault(field_name, [])
+        for value in values:
+            if value in cancelled:
+                cancelled.remove(value)
+            if value not in pending:
+                pending.append(value)
+
+    def to_operations(self, document_id: str) -> list[UpdateOne]:
+        """Return the bulk write operations applying the pending update to `document_id`."""
+        pull = {name: {"$in": values} for name, values in self.pull.items() if values}
+        add_to_set = {name: {"$each": values} for name, values in self.add_to_set.items() if values}
+
+        update = {}
+        if self.to_set:
+            update["$set"] = self.to_set
+        if pull:
+            update["$pull"] = pull
+        # A single update can't both pull from and add to the same field, those are written afterwards.
+        conflicting = {name: values for name, values in add_to_set.items() if name in pull}
+        if non_conflicting := {name: values for name, values in add_to_set.items() if name not in pull}:
+            update["$addToSet"] = non_conflicting
+
+        operations = []
+        if update:
+            operations.append(UpdateOne({"_id": document_id}, update, upsert=True))
+        if conflicting:
+            operations.append(UpdateOne({"_id": document_id}, {"$addToSet": conflicting}, upsert=True))
+        return operations
+
+
+class WriteBehindBuffer:
+    """
+    Buffer updates to a plugin db partition and write them in bulk.
+
+    Updates to the same document are merged together, and written with a single
+    `bulk_write` once `max_pending` updates are waiting or every `flush_interval` seconds.
+    These writes happen in the background and are retried until they succeed.
+
+    Callers which need the update to be written before carrying on can pass `durable=True`,
+    the update is then written straight away and isn't retried if that fails.
+
+    Only the `$set`, `$addToSet` and `$pull` operators are supported, and every update upserts.
+    """
+
+    def __init__(
+        self,
+        collection: "AsyncIOMotorCollection",
+        supervisor: "TaskSupervisor",
+        owner: str,
+        *,
+        max_pending: int = 50,
+        flush_interval: float = 5.0,
+    ):
+        self.collection = collection
+        self.supervisor = supervisor
+        self.owner = owner
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+
+        self._pending: dict[str, _PendingUpdate] = {}
+        self._pending_count = 0
+        # Operations written before the pending updates: those of a failed flush,
+        # and pending updates which a later update of the same document conflicted with.
+        self._queued: list[UpdateOne] = []
+        self._flush_lock = asyncio.Lock()
+
+        self.updates_requested = 0
+        self.operations_written = 0
+        self.flushes = 0
+
+    def start(self) -> None:
+        """Start flushing the buffer periodically."""
+        self.supervisor.spawn(self.owner, self._flush_periodically(), name="db-write-behind", group="db")
+
+    async def close(self) -> None:
+        """Write every pending update, to be called when the plugin unloads."""
+        try:
+            await self.flush()
+        except PyMongoError:
+            log.exception("Failed to write %d pending db updates of %s.", len(self._queued), self.owner)
+
+    async def update(self, document_id: str, update: dict[str, dict], *, durable: bool = False) -> None:
+        """
+        Queue `update` of the document with the id `document_id`.
+
+        If `durable` is True, write the update along with the pending ones and wait for it to be
+        written, raising if the write fails. Otherwise this never waits on the db nor raises.
+        """
+        self.updates_requested += 1
+        if durable:
+            durable_update = _PendingUpdate()
+            durable_update.merge(update)
+            await self._write(durable_update.to_operations(document_id))
+            return
+
+        pending = self._pending.get(document_id)
+        if pending is not None and not pending.merge(update):
+            # The update conflicts with the pending one, which has to be written first.
+            self._queued.extend(self._pending.pop(document_id).to_operations(document_id))
+            pending = None
+        if pending is None:
+            self._pending[document_id] = _PendingUpdate()
+            self._pending[document_id].merge(update)
+        self._pending_count += 1
+
+        if self._pending_count >= self.max_pending:
+            self.supervisor.spawn(self.owner, self._flush_logged(), name="db-flush", group="db")
+
+    async def flush(self) -> None:
+        """Write all the pending updates to the db."""
+        await self._write([])
+
+    async def _write(self, durable_operations: list[UpdateOne]) -> None:
+        """
+        Write the pending updates to the db, followed by `durable_operations`.
+
+        If the write fails, the pending updates are retried on the next flush. All supported
+        updates are idempotent, so retrying the whole batch is safe. The durable operations
+        are dropped instead, as their caller is told they failed.
+        """
+        async with self._flush_lock:
+            operations = self._queued + [
+                operation
+                for document_id, pending in self._pending.items()
+                for operation in pending.to_operations(document_id)
+            ]
+            self._queued = []
+            self._pending = {}
+            self._pending_count = 0
+            if not operations and not durable_operations:
+                return
+
+            try:
+                await self.collection.bulk_write(operations + durable_operations, ordered=True)
+            except (PyMongoError, asyncio.CancelledError):
+                # Updates which conflicted with pending ones during the write come after these.
+                self._queued = operations + self._queued
+                raise
+
+            self.flushes += 1
+            self.operations_written += len(operations) + len(durable_operations)
+            log.debug("Wrote %d db operations for %s.", len(operations) + len(durable_operations), self.owner)
+
+    async def _flush_logged(self) -> None:
+        """Flush the buffer, logging failures as the updates are retried on the next flush."""
+        try:
+            await self.flush()
+        except PyMongoError:
+            log.exception("Failed to write pending db updates of %s, retrying later.", self.owner)
+
+    async def _flush_periodically(self) -> None:
+        """Flush the buffer every `flush_interval` seconds."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_logged()
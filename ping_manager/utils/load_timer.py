@@ -0,0 +1,36 @@
+import contextlib
+import time
+import typing as t
+
+from core.models import getLogger
+
+log = getLogger(__name__)
+
+
+class LoadTimer:
+    """Time the phases of a plugin's load, to log how long each of them took."""
+
+    def __init__(self, plugin: str):
+        self.plugin = plugin
+        self.start = time.perf_counter()
+        self.phases: dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> t.Iterator[None]:
+        """Record the time taken by the body of the `with` statement as the phase `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - start
+
+    def log(self, what: str = "Loaded") -> None:
+        """Log the total time since the timer was created, and the time taken by each phase."""
+        phases = ", ".join(f"{name}: {duration * 1000:.0f}ms" for name, duration in self.phases.items())
+        log.info(
+            "%s %s in %.0fms%s",
+            what,
+            self.plugin,
+            (time.perf_counter() - self.start) * 1000,
+            f" ({phases})" if phases else "",
+        )
@@ -0,0 +1,278 @@
+"""
+Schedule the Discord REST calls of plugins, through a scheduler shared by every plugin via the bot.
+
+The scheduler lives on the bot under an attribute including `SCHEDULER_VERSION`, and every plugin has
+its own copy of this module, so plugins installed at refs with different versions each use a scheduler
+of their own version. Bump the version on any change to `RestScheduler` or the classes it uses.
+
+A scheduler of the same version isn't replaced when a plugin is reloaded, e.g. with `?plugin update`,
+and runs the code of the copy which created it until the bot restarts. Schedulers of older versions
+are dropped from the bot once no call is waiting or being made through them.
+"""
+import asyncio
+import enum
+import heapq
+import itertools
+import time
+import typing as t
+from dataclasses import dataclass, field
+
+from core.models import getLogger
+
+if t.TYPE_CHECKING:
+    from bot import ModmailBot
+
+log = getLogger(__name__)
+
+# Version of `RestScheduler`, part of the attribute of the bot holding the scheduler shared by every plugin.
+SCHEDULER_VERSION = 1
+SCHEDULER_ATTRIBUTE = f"_pydis_rest_scheduler_v{SCHEDULER_VERSION}"
+
+# Maximum number of REST calls made through the scheduler at the same time.
+MAX_CONCURRENT_CALLS = 5
+
+# (calls, per seconds) allowed for each route, routes without an entry aren't limited.
+# These match the limits Discord applies to these routes in practice, so our own calls queue
+# here in priority order instead of waiting in discord.py's rate limiter in the order they came.
+# Discord doesn't document them and they may change, other routes are left to discord.py.
+ROUTE_LIMITS = {
+    "channel.send": (5, 5.0),  # Messages per channel.
+    "channel.rename": (2, 600.0),  # Name changes per channel.
+}
+
+# Number of route buckets kept before the ones that are full again get dropped.
+MAX_IDLE_BUCKETS = 1000
+# Fraction of a token under which a bucket is still considered to have a token.
+TOKEN_EPSILON = 1e-9
+
+T = t.TypeVar("T")
+
+
+class Priority(enum.IntEnum):
+    """Priority classes of REST calls, calls with a lower value go first."""
+
+    PING = 0  # Pings in threads nobody replied to.
+    MODERATION = 1  # Kicks and moving threads.
+    STATUS = 2  # Status messages, DMs and renames of threads.
+    LOG = 3  # Messages in log channels.
+
+
+@dataclass
+class PriorityStats:
+    """Queueing counters of a priority class."""
+
+    calls: int = 0
+    queued: int = 0
+    max_queued: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def mean_wait(self) -> float:
+        """Average time calls of this class waited before being made."""
+        return self.total_wait / self.calls if self.calls else 0.0
+
+
+@dataclass
+class TokenBucket:
+    """
+    A token bucket allowing `rate` calls every `per` seconds.
+
+    When the bucket is empty, tokens are handed to the waiter with the highest priority first
+    as they refill. Time is measured with the event loop's clock, so the bucket must be used
+    from a running loop.
+    """
+
+    rate: int
+    per: float
+    tokens: float = field(init=False)
+    updated: float = field(init=False)
+    _waiters: list[tuple[int, int, asyncio.Future]] = field(init=False, default_factory=list)
+    _counter: t.Iterator[int] = field(init=False, default_factory=itertools.count)
+    _timer: t.Optional[asyncio.TimerHandle] = field(init=False, default=None)
+
+    def __post_init__(self) -> None:
+        self.tokens = self.rate
+        self.updated = asyncio.get_running_loop().time()
+
+    def _refill(self) -> None:
+        now = asyncio.get_running_loop().time()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+    def _has_token(self) -> bool:
+        # Allow for rounding errors, which would otherwise leave the bucket just short of a token.
+        return self.tokens >= 1 - TOKEN_EPSILON
+
+    @property
+    def full(self) -> bool:
+        """Whether the bucket has all its tokens and nobody waiting for one."""
+        self._refill()
+        return not self._waiters and self.tokens >= self.rate
+
+    async def acquire(self, priority: Priority) -> None:
+        """Take a token from the bucket, waiting for one to be available if needed."""
+        self._refill()
+        if self._has_token() and not self._waiters:
+            self.tokens -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._schedule_wake_up()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The token was handed over just before the cancellation, give it to the next waiter.
+                self.tokens += 1
+                self._wake_up()
+            raise
+
+    def _schedule_wake_up(self) -> None:
+        """Wake up the waiters once the next token has refilled."""
+        if self._timer is None and self._waiters:
+            delay = max(0.0, (1 - self.tokens) * self.per / self.rate)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._wake_up)
+
+    def _wake_up(self) -> None:
+        """Hand the available tokens to the waiters in order of priority."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._waiters and self._has_token():
+            *_, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.tokens -= 1
+                future.set_result(None)
+        # Drop cancelled waiters, so they don't keep the bucket awake.
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        self._schedule_wake_up()
+
+
+class _PrioritySlots:
+    """A semaphore handing free slots to the waiter with the highest priority first."""
+
+    def __init__(self, slots: int):
+        self._slots = slots
+        self._free = slots
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    @property
+    def idle(self) -> bool:
+        return not self._waiters and self._free == self._slots
+
+    async def acquire(self, priority: Priority) -> None:
+        if self._free and not self._waiters:
+            self._free -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just before the cancellation.
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            *_, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free += 1
+
+
+class RestScheduler:
+    """
+    Schedule the Discord REST calls of all plugins.
+
+    Calls are made at most `MAX_CONCURRENT_CALLS` at a time, with waiting calls going in
+    order of their `Priority`. Calls to a route listed in `route_limits`, `ROUTE_LIMITS` by
+    default, additionally wait for a token of that route's bucket, also in order of priority.
+
+    A single scheduler is shared by every plugin through `get_scheduler`.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = MAX_CONCURRENT_CALLS,
+        route_limits: t.Optional[dict[str, tuple[int, float]]] = None,
+    ):
+        self._slots = _PrioritySlots(concurrency)
+        self.route_limits = ROUTE_LIMITS if route_limits is None else route_limits
+        self._buckets: dict[str, TokenBucket] = {}
+        self.stats: dict[Priority, PriorityStats] = {priority: PriorityStats() for priority in Priority}
+
+    def _get_bucket(self, route: str) -> t.Optional[TokenBucket]:
+        """Return the bucket of `route`, in the `name:major_id` format, or None if it isn't limited."""
+        route_name = route.split(":", maxsplit=1)[0]
+        if route_name not in self.route_limits:
+            return None
+
+        if route not in self._buckets:
+            if len(self._buckets) >= MAX_IDLE_BUCKETS:
+                self._buckets = {key: bucket for key, bucket in self._buckets.items() if not bucket.full}
+            self._buckets[route] = TokenBucket(*self.route_limits[route_name])
+        return self._buckets[route]
+
+    @property
+    def idle(self) -> bool:
+        """Whether no call is waiting or being made."""
+        return self._slots.idle and not any(stats.queued for stats in self.stats.values())
+
+    async def call(
+        self,
+        priority: Priority,
+        route: str,
+        func: t.Callable[..., t.Awaitable[T]],
+        *args,
+        **kwargs,
+    ) -> T:
+        """
+        Await `func(*args, **kwargs)` once the scheduler allows a call of `priority` to `route`.
+
+        `route` is in the format `name:major_id`, for example `channel.send:1234`.
+        """
+        stats = self.stats[priority]
+        stats.queued += 1
+        stats.max_queued = max(stats.max_queued, stats.queued)
+        start = time.perf_counter()
+        try:
+            if bucket := self._get_bucket(route):
+                await bucket.acquire(priority)
+            await self._slots.acquire(priority)
+        finally:
+            stats.queued -= 1
+
+        waited = time.perf_counter() - start
+        stats.calls += 1
+        stats.total_wait += waited
+        stats.max_wait = max(stats.max_wait, waited)
+        if waited > 1:
+            log.debug("%s call to %s waited %.2fs to be made.", priority.name, route, waited)
+
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            self._slots.release()
+
+
+def get_scheduler(bot: "ModmailBot") -> RestScheduler:
+    """Return the REST scheduler shared by all plugins, creating it if needed, and drop idle older ones."""
+    for version in range(1, SCHEDULER_VERSION):
+        attribute = f"_pydis_rest_scheduler_v{version}"
+        if getattr(getattr(bot, attribute, None), "idle", False):
+            delattr(bot, attribute)
+
+    scheduler = getattr(bot, SCHEDULER_ATTRIBUTE, None)
+    if scheduler is None:
+        scheduler = RestScheduler()
+        setattr(bot, SCHEDULER_ATTRIBUTE, scheduler)
+    return scheduler
@@ -1,45 +1,147 @@
+import hashlib
 import time
-from collections import deque
+import typing as t
+from datetime import datetime, timedelta
 
 import discord
 from discord.ext import commands
+from pymongo.errors import DuplicateKeyError, PyMongoError
 
 from bot import ModmailBot
+from core import checks
+from core.models import PermissionLevel, getLogger
 from core.thread import Thread
 
-# Number of messages kept in memory to check for double sends
-BUFFER_LENGTH = 10
-# Buffer of messages recently sent
-# Each entry is under the format (channel_id, message_content, timestamp).
-MESSAGES_BUFFER = deque(maxlen=BUFFER_LENGTH)
+# Number of recent replies kept in memory to check for double sends
+CACHE_SIZE = 1000
 # Cooldown time
 COOLDOWN_TIME = 10
 
+log = getLogger(__name__)
+
+
+class ReplyCooldown(commands.Cog):
+    """
+    A plugin forbidding to send the same reply twice in a thread within the cooldown time.
+
+    Recent replies are kept in memory. When the shared cooldown is enabled, they're also claimed
+    in the plugin's db partition, so duplicates are caught across restarts and between bots
+    connected to the same database. The db is only queried when the reply isn't in memory.
+    """
+
+    def __init__(self, bot: ModmailBot):
+        self.bot = bot
+        self.db = self.bot.plugin_db.get_partition(self)
+
+        # Time at which the cooldown of each recent (channel id, content) ends.
+        self.recent_replies: dict[tuple[int, str], float] = {}
+        self.shared = False
+
+        self._original_reply: t.Optional[t.Callable[..., t.Awaitable[None]]] = None
+        self._patched_reply: t.Optional[t.Callable[..., t.Awaitable[None]]] = None
+        self._active = False
+
+    async def cog_load(self) -> None:
+        """Load the config from the db, and monkey patch the built-in reply function to add the cooldown."""
+        config = await self.db.find_one({"_id": "reply-cooldown-config"}) or {}
+        self.shared = config.get("shared", False)
+        if self.shared:
+            await self._create_ttl_index()
+
+        self._original_reply = Thread.reply
+        cog = self
+
+        async def reply(
+            self: Thread,
+            message: discord.Message,
+            content: str = None,
+            anonymous: bool = False,
+            plain: bool = False,
+        ) -> None:
+            """The new reply function with a cooldown between uses."""
+            # Bypass the cooldown if the message has attachments.
+            if cog._active and not message.attachments and await cog.is_duplicate(message):
+                await message.add_reaction("\u274c")
+                return
+            await cog._original_reply(self, message, content, anonymous, plain)
+
+        self._patched_reply = reply
+        Thread.reply = reply
+        self._active = True
+
+    async def cog_unload(self) -> None:
+        """Restore the built-in reply function."""
+        self._active = False
+        # Another plugin may have wrapped our patch since, it then stays in place without the cooldown.
+        if Thread.reply is self._patched_reply:
+            Thread.reply = self._original_reply
+
+    async def _create_ttl_index(self) -> None:
+        """Have the db delete claims of replies once their cooldown is over."""
+        await self.db.create_index("expires_at", expireAfterSeconds=0)
+
+    def _remember(self, key: tuple[int, str], expires_at: float) -> None:
+        """Keep `key` in memory until `expires_at`, dropping expired replies, and the oldest ones when full."""
+        self.recent_replies.pop(key, None)
+        # Replies are kept in the order their cooldown ends, so the ones to drop come first.
+        now = time.time()
+        while self.recent_replies:
+            oldest = next(iter(self.recent_replies))
+            if len(self.recent_replies) < CACHE_SIZE and self.recent_replies[oldest] > now:
+                break
+            del self.recent_replies[oldest]
+        self.recent_replies[key] = expires_at
+
+    async def _claim(self, channel_id: int, content: str) -> bool:
+        """
+        Claim the reply in the shared store, returning False if it's already claimed and still on cooldown.
+
+        Expired claims are taken over, and a claim that's still on cooldown makes the upsert
+        collide with the existing document.
+        """
+        digest = hashlib.sha256(content.encode()).hexdigest()
+        now = datetime.utcnow()
+        try:
+            await self.db.find_one_and_update(
+                {"_id": f"reply-{channel_id}-{digest}", "expires_at": {"$lte": now}},
+                {"$set": {"expires_at": now + timedelta(seconds=COOLDOWN_TIME)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return False
+        except PyMongoError:
+            # Don't block replies because the db is unavailable, the local cooldown still applies.
+            log.exception("Failed to claim a reply in the shared cooldown store.")
+        return True
+
+    async def is_duplicate(self, message: discord.Message) -> bool:
+        """Return whether the same reply was sent in the thread within the cooldown time, and start its cooldown."""
+        key = (message.channel.id, message.content)
+        now = time.time()
+        if self.recent_replies.get(key, 0) > now:
+            return True
+
+        # Remember the reply before querying the db, so a duplicate sent meanwhile hits the cache.
+        self._remember(key, now + COOLDOWN_TIME)
+        if not self.shared:
+            return False
+        return not await self._claim(message.channel.id, message.content)
+
+    @checks.has_permissions(PermissionLevel.OWNER)
+    @commands.command()
+    async def shared_reply_cooldown(self, ctx: commands.Context, enabled: bool) -> None:
+        """Share the reply cooldown between every bot connected to the database, and keep it across restarts."""
+        self.shared = enabled
+        if enabled:
+            await self._create_ttl_index()
+        await self.db.update_one(
+            {"_id": "reply-cooldown-config"},
+            {"$set": {"shared": enabled}},
+            upsert=True,
+        )
+        await ctx.send(f":+1: The reply cooldown is now {'shared' if enabled else 'local to this bot'}.")
+
 
 async def setup(bot: ModmailBot) -> None:
-    """Monkey patch the built-in reply function to add a cooldown between uses."""
-    _reply = Thread.reply
-
-    async def reply(
-        self: commands.Cog,
-        message: discord.Message,
-        content: str = None,
-        anonymous: bool = False,
-        plain: bool = False,
-    ) -> None:
-        """The new reply function with a cooldown between uses."""
-        # Bypass the cooldown if the message has attachments.
-        if not message.attachments:
-            for entry in MESSAGES_BUFFER:
-                if (
-                    entry[0] == message.channel.id
-                    and entry[1] == message.content
-                    and entry[2] > (time.time() - COOLDOWN_TIME)
-                ):
-                    await message.add_reaction("\u274c")
-                    return
-
-        MESSAGES_BUFFER.append((message.channel.id, message.content, time.time()))
-        await _reply(self, message, content, anonymous, plain)
-
-    Thread.reply = reply
+    """Add the ReplyCooldown plugin."""
+    await bot.add_cog(ReplyCooldown(bot))
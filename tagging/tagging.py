@@ -5,6 +5,8 @@ from discord.ext import commands
 from bot import ModmailBot
 from core import checks
 from core.models import PermissionLevel
+from .utils import rest_scheduler
+from .utils.rest_scheduler import Priority
 
 
 class Tagging(commands.Cog):
@@ -12,6 +14,7 @@ class Tagging(commands.Cog):
 
     def __init__(self, bot: ModmailBot):
         self.bot = bot
+        self.rest = rest_scheduler.get_scheduler(bot)
 
     @checks.has_permissions(PermissionLevel.SUPPORTER)
     @commands.command()
@@ -32,7 +35,7 @@ class Tagging(commands.Cog):
         await ctx.reply(
             "Changes may take up to 10 minutes to take effect due to rate-limits."
         )
-        await ctx.channel.edit(name=name)
+        await self.rest.call(Priority.STATUS, f"channel.rename:{ctx.channel.id}", ctx.channel.edit, name=name)
         await ctx.message.add_reaction("\u2705")
 
 